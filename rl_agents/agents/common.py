@@ -1,6 +1,9 @@
 import copy
 import importlib
 import json
+import threading
+import time
+
 import gym
 from gym import logger
 
@@ -103,3 +106,140 @@ def safe_deepcopy_env(obj):
         else:
             setattr(result, k, None)
     return result
+
+
+class EnvCopier(object):
+    """
+        Copies environments for planning, through the cheapest method that they support:
+
+        - "snapshot": the environment implements get_state() and set_state(snapshot), and a scratch environment is
+          restored in place from a compact snapshot of its state;
+        - "clone": the environment implements clone();
+        - "deepcopy": safe_deepcopy_env() is used as a fallback.
+
+        Wrappers forward these methods to the environment that they wrap, whose copy would not include the state of
+        the wrappers (e.g. the elapsed steps of a TimeLimit), and are thus always deep copied.
+
+        The number of copies and time spent are recorded for each method.
+    """
+    def __init__(self):
+        self.stats = {}
+        """ Number of copies and time spent, for each copy method"""
+        self.local = threading.local()
+
+    @staticmethod
+    def implements(env, method):
+        """
+            Whether an environment implements a copy method itself, rather than forwarding it through a wrapper.
+
+        :param env: an environment
+        :param method: the name of the method
+        :return: whether the method can be used to copy env
+        """
+        return not isinstance(env, gym.Wrapper) and hasattr(type(env), method)
+
+    @classmethod
+    def supports_snapshots(cls, env):
+        return cls.implements(env, "get_state") and cls.implements(env, "set_state")
+
+    def snapshot(self, env):
+        """
+            Take a snapshot of an environment state, if supported.
+
+        :param env: an environment
+        :return: its snapshot, or None
+        """
+        return env.get_state() if self.supports_snapshots(env) else None
+
+    def copy(self, env):
+        """
+            Get an independent copy of an environment.
+
+        :param env: an environment
+        :return: a new environment in the same state
+        """
+        start = time.perf_counter()
+        if self.implements(env, "clone"):
+            result, method = env.clone(), "clone"
+        else:
+            result, method = safe_deepcopy_env(env), "deepcopy"
+        self.record(method, start)
+        return result
+
+    def restore(self, env, snapshot=None, slot=0):
+        """
+            Get a copy of an environment, that may be overwritten by the next restore() call in the same slot and thread.
+
+        :param env: an environment
+        :param snapshot: a snapshot of the environment state, taken from env if None
+        :param slot: the scratch environment to use, when several copies must be used at the same time
+        :return: an environment in the same state as env
+        """
+        if not self.supports_snapshots(env):
+            return self.copy(env)
+        scratches = self.local.__dict__.setdefault("scratches", {})
+        scratch = scratches.get(slot)
+        if type(scratch) is not type(env):
+            scratch = scratches[slot] = self.copy(env)
+        start = time.perf_counter()
+        scratch.set_state(snapshot if snapshot is not None else env.get_state())
+        self.record("snapshot", start)
+        return scratch
+
+    def record(self, method, start):
+        stats = self.stats.setdefault(method, dict(count=0, time=0))
+        stats["count"] += 1
+        stats["time"] += time.perf_counter() - start
+
+
+class EnvClonePool(object):
+    """
+        A pool of reusable environment copies.
+
+        Released copies are kept, and later reset in place to the state of another environment with set_state(),
+        instead of allocating new copies that the garbage collector would have to reclaim.
+        Environments that do not support snapshots cannot be reset in place: they are copied by the copier, and
+        their released copies are dropped.
+    """
+    def __init__(self, copier, size=64):
+        """
+        :param copier: the EnvCopier used to allocate new copies
+        :param size: the maximum number of released copies kept in the pool
+        """
+        self.copier = copier
+        self.size = size
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self, env, snapshot=None):
+        """
+            Get an independent copy of an environment, reusing a released copy if possible.
+
+        :param env: an environment
+        :param snapshot: a snapshot of the environment state, taken from env if None
+        :return: a copy in the same state as env, to be released once it is no longer used
+        """
+        clone = None
+        if self.copier.supports_snapshots(env):
+            with self.lock:
+                for i in range(len(self.free) - 1, -1, -1):
+                    if type(self.free[i]) is type(env):
+                        clone = self.free.pop(i)
+                        break
+        if clone is None:
+            return self.copier.copy(env)
+        start = time.perf_counter()
+        clone.set_state(snapshot if snapshot is not None else env.get_state())
+        self.copier.record("pool", start)
+        return clone
+
+    def release(self, clone):
+        """
+            Give a copy back to the pool.
+
+        :param clone: a copy obtained by acquire()
+        """
+        if clone is not None and self.copier.supports_snapshots(clone):
+            with self.lock:
+                if len(self.free) < self.size:
+                    self.free.append(clone)
@@ -1,9 +1,23 @@
+import copy
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+
 import numpy as np
 from gym import logger
 from gym.utils import seeding
 
 from rl_agents.agents.abstract import AbstractAgent
-from rl_agents.agents.common import preprocess_env
+from rl_agents.agents.common import preprocess_env, EnvCopier, EnvClonePool
+from rl_agents.agents.tree_search.mdp_model import FiniteMDPModel, get_finite_mdp
+from rl_agents.agents.tree_search.plan_cache import PlanCache
+from rl_agents.agents.tree_search.stats import PlannerStats
+from rl_agents.agents.tree_search.transposition import TranspositionTable
+from rl_agents.agents.tree_search.traversal import depth_first
 from rl_agents.configuration import Configurable
 
 
@@ -19,11 +33,70 @@ class AbstractTreeSearchAgent(AbstractAgent):
         super(AbstractTreeSearchAgent, self).__init__(config)
         self.env = env
         self.planner = self.make_planner()
-        self.previous_action = None
+        self.previous_actions = []
+        """ Actions performed since the last planning call, by which the planner tree must be stepped"""
+        self.remaining_plan = []
+        """ The rest of the last plan, after the actions already performed"""
+        self.remaining_commitment = 0
+        """ Number of actions of the remaining plan to be performed before planning again"""
+        self.mdp_model = None
+        """ The model of the environment finite MDP, if it is used for planning"""
+        self.batch_agent = None
+        self.batch_pool = None
+        self.batch_directory = None
+        """ A temporary directory holding the trained models loaded by the batch planning copies of the agent"""
+        self.batch_stats = dict(roots=0, time=0, roots_per_second=0)
+        """ Aggregate throughput of the batch planning calls"""
+
+        self.ponder_thread = None
+        self.ponder_stop = threading.Event()
+        self.ponder_iterations = 0
+        """ Number of pondering iterations run between the two last decisions"""
+        if self.config["ponder"] and self.config["step_strategy"] == "reset":
+            logger.warn("Pondering is useless with the reset step strategy, since the tree is discarded")
+
+        self.plan_cache = None
+        if self.config["plan_cache_size"]:
+            planner_config = {key: value for key, value in self.planner.config.items()
+                              if not key.startswith("plan_cache")}
+            self.plan_cache = PlanCache(planner_config,
+                                        size=self.config["plan_cache_size"],
+                                        fingerprint=self.planner.config["fingerprint"],
+                                        subtrees=self.config["plan_cache_subtrees"],
+                                        path=self.config["plan_cache_path"])
 
     @classmethod
     def default_config(cls):
-        return dict(env_preprocessors=[])
+        """
+            When ponder is enabled, a background thread keeps expanding the subtree of the chosen action for up to
+            ponder_budget iterations, between a planning call and the next one.
+
+            When plan_cache_size is positive, the plans are cached by root state fingerprint and planner
+            configuration, and planning is skipped for known states. With plan_cache_subtrees, the planner trees are
+            cached too, and with plan_cache_path, the plans are persisted in this file at the end of each episode.
+
+            The receding_horizon option is the number of actions of each plan that are performed before planning
+            again. When receding_horizon_confidence is set, this number is adaptive: after the first action, the agent
+            only commits to the next actions of the plan while their share of the visits of their siblings is at
+            least this confidence level.
+
+            The finite_mdp option enables planning with a FiniteMDPModel of the environment instead of copies of the
+            environment itself: with "auto", only for finite_mdp environments, and with True, also for environments
+            that can be converted with to_finite_mdp().
+
+            The batch_workers option is the number of worker processes sharing the roots of plan_batch() calls, or 0
+            to plan them sequentially.
+        """
+        return dict(env_preprocessors=[],
+                    ponder=False,
+                    ponder_budget=500,
+                    plan_cache_size=0,
+                    plan_cache_subtrees=False,
+                    plan_cache_path=None,
+                    receding_horizon=1,
+                    receding_horizon_confidence=None,
+                    finite_mdp="auto",
+                    batch_workers=0)
 
     def make_planner(self):
         raise NotImplementedError()
@@ -32,20 +105,244 @@ class AbstractTreeSearchAgent(AbstractAgent):
         """
             Plan an optimal sequence of actions.
 
-            Start by updating the previously found tree with the last action performed.
+            Start by updating the previously found tree with the last actions performed.
+            If the agent committed to several actions of its previous plan, the rest of this plan is returned instead,
+            and its first action is assumed to be performed.
 
         :param observation: the current state
         :return: the list of actions
         """
-        self.planner.step(self.previous_action)
-        env = preprocess_env(self.env, self.config["env_preprocessors"])
-        actions = self.planner.plan(state=env, observation=observation)
-
-        self.previous_action = actions[0]
+        if self.remaining_commitment > 0 and self.remaining_plan:
+            actions = self.remaining_plan
+            self.remaining_plan = actions[1:]
+            self.remaining_commitment -= 1
+            self.previous_actions.append(actions[0])
+            return actions
+
+        self.stop_pondering()
+        self.planner.start_stats()
+        env = self.planning_env(preprocess_env(self.env, self.config["env_preprocessors"]))
+        key = self.plan_cache.key(env, observation) if self.plan_cache else None
+        cached = self.plan_cache.get(key) if self.plan_cache else None
+        if cached is None:
+            for action in self.previous_actions:
+                self.planner.step(action)
+            actions = self.planner.plan(state=env, observation=observation)
+            if self.plan_cache:
+                self.planner.stats.add("plan_cache_misses")
+                self.plan_cache.put(key, actions, self.planner)
+        else:
+            actions, tree = cached
+            self.planner.iterations_used = 0
+            self.planner.stats.add("plan_cache_hits")
+            if tree is not None:
+                self.planner.set_root(tree)
+            else:
+                self.planner.step_by_reset()
+        commitment = self.commitment(actions)
+        self.planner.stats.add("committed_actions", commitment)
+        self.planner.end_stats()
+
+        self.previous_actions = [actions[0]]
+        self.remaining_plan = actions[1:]
+        self.remaining_commitment = commitment - 1
+        if self.config["ponder"]:
+            self.start_pondering(env, observation, actions[0])
         return actions
 
+    def plan_batch(self, states, observations):
+        """
+            Plan optimal sequences of actions from many independent environment states.
+
+            The roots are planned by a copy of this agent, whose tree is left unchanged, or by copies in a pool of
+            batch_workers processes. The copies are created by the first call, with the trained models of the agent
+            at that time, see batch_config(). When supported, the root priors of all states are evaluated in a single
+            batch.
+
+        :param states: the list of environment states
+        :param observations: the corresponding observations
+        :return: the list of plans, one for each state
+        """
+        start = time.perf_counter()
+        priors = self.batch_priors(states, observations) or [None] * len(states)
+        seeds = [int(seed) for seed in self.planner.np_random.randint(2**31, size=len(states))]
+        roots = list(zip(states, observations, priors, seeds))
+        if self.config["batch_workers"]:
+            if self.batch_pool is None:
+                self.batch_pool = multiprocessing.Pool(self.config["batch_workers"],
+                                                       initializer=start_batch_worker,
+                                                       initargs=(type(self), self.batch_config(), states[0]))
+            plans = self.batch_pool.starmap(plan_root_in_worker, roots)
+        else:
+            if self.batch_agent is None:
+                self.batch_agent = type(self)(states[0], self.batch_config())
+            plans = [plan_root(self.batch_agent, *root) for root in roots]
+
+        self.batch_stats["roots"] += len(states)
+        self.batch_stats["time"] += time.perf_counter() - start
+        self.batch_stats["roots_per_second"] = self.batch_stats["roots"] / self.batch_stats["time"]
+        return plans
+
+    def batch_config(self):
+        """
+            Get the configuration of the copies of the agent that plan the roots of batch planning calls.
+
+            Agents using trained models must save them with save_batch_model(), and set their paths in the
+            configuration so that the copies load them instead of creating new models. The copies do not ponder,
+            nor persist their plan caches in the file of the agent.
+
+        :return: the configuration of the copies
+        """
+        config = copy.deepcopy(self.config)
+        config["ponder"] = False
+        config["plan_cache_path"] = None
+        return config
+
+    def save_batch_model(self, agent, name):
+        """
+            Save the model of an agent in a temporary directory, to be loaded by the batch planning copies.
+
+        :param agent: the agent whose model is saved
+        :param name: the name of the model file
+        :return: the path of the model file, or None if the agent cannot save its model
+        """
+        if self.batch_directory is None:
+            self.batch_directory = tempfile.mkdtemp(prefix="batch_models_")
+        path = os.path.join(self.batch_directory, name)
+        try:
+            agent.save(path)
+        except NotImplementedError:
+            logger.warn("The {} model cannot be saved, the batch planning copies use a new one"
+                        .format(agent.__class__.__name__))
+            return None
+        return path
+
+    def batch_priors(self, states, observations):
+        """
+            Evaluate the prior action distributions of many root states in a single batch, if supported.
+
+        :param states: the list of environment states
+        :param observations: the corresponding observations
+        :return: the list of (actions, probabilities) of each root, or None
+        """
+        return None
+
+    def close(self):
+        """
+            Stop the pondering thread, and the worker processes of batch planning and of the planner.
+        """
+        self.stop_pondering()
+        self.planner.close()
+        self.close_batch()
+
+    def close_batch(self):
+        """
+            Discard the copies of the agent used for batch planning, which are created again by the next call.
+        """
+        if self.batch_agent:
+            self.batch_agent.close()
+            self.batch_agent = None
+        if self.batch_pool:
+            self.batch_pool.terminate()
+            self.batch_pool.join()
+            self.batch_pool = None
+        if self.batch_directory:
+            shutil.rmtree(self.batch_directory, ignore_errors=True)
+            self.batch_directory = None
+
+    def planning_env(self, env):
+        """
+            Get the environment to be simulated by the planner, which is a model of its finite MDP if enabled.
+
+        :param env: the environment
+        :return: the environment, or a model of its finite MDP
+        """
+        if not self.config["finite_mdp"]:
+            return env
+        mdp = get_finite_mdp(env, convert=self.config["finite_mdp"] is True)
+        if mdp is None:
+            return env
+        if self.mdp_model is None or self.mdp_model.mdp is not mdp:
+            self.mdp_model = FiniteMDPModel(mdp, np_random=self.planner.np_random)
+        # The previous model may still be used by the planner tree, and cloning it keeps the precomputed arrays
+        model = self.mdp_model.clone()
+        model.set_state(mdp.state)
+        model.np_random = self.planner.np_random
+        return model
+
+    def commitment(self, actions):
+        """
+            Choose the number of actions of a plan to perform before planning again.
+
+        :param actions: the planned actions
+        :return: the number of actions, at least one
+        """
+        horizon = min(self.config["receding_horizon"], len(actions))
+        confidence = self.config["receding_horizon_confidence"]
+        if confidence is None:
+            return max(horizon, 1)
+        node = self.planner.root
+        commitment = 0
+        for action in actions[:horizon]:
+            child = node.children.get(action)
+            if child is None:
+                break
+            if commitment > 0:
+                total_count = sum(sibling.count for sibling in node.children.values())
+                if not total_count or child.count < confidence * total_count:
+                    break
+            commitment += 1
+            node = child
+        return max(commitment, 1)
+
+    def start_pondering(self, state, observation, action):
+        """
+            Start expanding the subtree of a chosen action in a background thread.
+
+            The state is copied right away, since the environment is about to be stepped.
+
+        :param state: the current environment state
+        :param observation: the corresponding observation
+        :param action: the chosen action
+        """
+        state = self.planner.env_copier.copy(state)
+        self.ponder_iterations = 0
+        self.ponder_thread = threading.Thread(target=self.ponder, args=(state, observation, action), daemon=True)
+        self.ponder_thread.start()
+
+    def ponder(self, state, observation, action):
+        """
+            Run pondering iterations of the planner, until stopped or out of budget.
+
+        :param state: the environment state at the root of the tree
+        :param observation: the corresponding observation
+        :param action: the chosen action
+        """
+        try:
+            while self.ponder_iterations < self.config["ponder_budget"] and not self.ponder_stop.is_set():
+                self.planner.ponder(state, observation, action)
+                self.ponder_iterations += 1
+        except NotImplementedError:
+            logger.warn("The {} planner does not support pondering".format(self.planner.__class__.__name__))
+
+    def stop_pondering(self):
+        """
+            Wait for the pondering thread to finish its current iteration and stop, so that the tree can be modified.
+        """
+        if self.ponder_thread:
+            self.ponder_stop.set()
+            self.ponder_thread.join()
+            self.ponder_stop.clear()
+            self.ponder_thread = None
+
     def reset(self):
+        self.stop_pondering()
         self.planner.step_by_reset()
+        self.previous_actions = []
+        self.remaining_plan = []
+        self.remaining_commitment = 0
+        if self.plan_cache:
+            self.plan_cache.save()
 
     def seed(self, seed=None):
         return self.planner.seed(seed)
@@ -63,30 +360,126 @@ class AbstractTreeSearchAgent(AbstractAgent):
         pass
 
 
+_batch_worker_agent = None
+""" The agent of a batch planning worker process"""
+
+
+def start_batch_worker(agent_class, config, env):
+    global _batch_worker_agent
+    _batch_worker_agent = agent_class(env, config)
+
+
+def plan_root_in_worker(state, observation, prior, seed):
+    return plan_root(_batch_worker_agent, state, observation, prior, seed)
+
+
+def plan_root(agent, state, observation, prior, seed):
+    """
+        Plan from a root state with a new tree.
+
+    :param agent: the agent planning
+    :param state: the root environment state
+    :param observation: the corresponding observation
+    :param prior: the (actions, probabilities) used to expand the root, if any
+    :param seed: the seed of the agent
+    :return: the list of actions
+    """
+    agent.env = state
+    agent.reset()
+    agent.seed(seed)
+    if prior is not None:
+        agent.planner.root.expand(prior)
+    return list(agent.plan(observation))
+
+
 class AbstractPlanner(Configurable):
     def __init__(self, config=None):
         super(AbstractPlanner, self).__init__(config)
         self.np_random = None
+        self.env_copier = EnvCopier()
+        """ Copies the environment states to be simulated, and records which copy method was used"""
+        self.clone_pool = EnvClonePool(self.env_copier, self.config["clone_pool_size"]) \
+            if self.config["clone_pool_size"] else None
+        self.transpositions = TranspositionTable(self.config["fingerprint"]) \
+            if self.config["transpositions"] else None
+        """ Nodes indexed by the fingerprint of their state, to detect that action sequences reach the same state"""
+        self.iterations_used = 0
+        """ Number of iterations run during the last planning call"""
+        self.stats = PlannerStats(self.config["instrumentation"])
+        self.plan_hooks = []
+        """ Functions called with the planner and its statistics at the end of each planning call"""
+        self.stats_start = None
+        self.tree_lock = threading.RLock()
+        """ Held while the tree is modified, e.g. by pondering, and while it is read by other threads, e.g. to be
+            displayed. It is reentrant, so that readers holding it can call get_plan()"""
         self.root = self.make_root()
         self.seed()
 
     @classmethod
     def default_config(cls):
+        """
+            The transpositions option enables a transposition table, in which the states reached by the planner are
+            identified by a fingerprint: "observation", "state", or the path "module.function" of a custom function
+            of the state and observation.
+        """
         return dict(budget=500,
                     gamma=0.8,
                     max_depth=6,
-                    step_strategy="reset")
+                    step_strategy="reset",
+                    clone_pool_size=0,
+                    time_budget=None,
+                    instrumentation=False,
+                    transpositions=False,
+                    fingerprint="observation")
 
     def make_root(self):
         raise NotImplementedError()
 
+    def scratch_env(self, state, snapshot=None, slot=0):
+        """
+            Get a copy of an environment state to be simulated, from the clone pool if enabled.
+
+        :param state: an environment state
+        :param snapshot: a snapshot of this state, if available
+        :param slot: the scratch slot of the copy, when the clone pool is disabled
+        :return: a copy of the state, to be released with release_env()
+        """
+        if self.clone_pool:
+            return self.clone_pool.acquire(state, snapshot)
+        return self.env_copier.restore(state, snapshot, slot)
+
+    def copy_env(self, state):
+        """
+            Get an independent copy of an environment state, from the clone pool if enabled.
+
+        :param state: an environment state
+        :return: a copy of the state, to be released with release_env()
+        """
+        if self.clone_pool:
+            return self.clone_pool.acquire(state)
+        return self.env_copier.copy(state)
+
+    def release_env(self, state):
+        """
+            Give a copy of an environment state back to the clone pool, if enabled.
+
+        :param state: a copy obtained by scratch_env() or copy_env()
+        """
+        if self.clone_pool:
+            self.clone_pool.release(state)
+
     def seed(self, seed=None):
         """
             Seed the planner randomness source, e.g. for rollout policy
         :param seed: the seed to be used
         :return: the used seed
         """
-        self.np_random, seed = seeding.np_random(seed)
+        np_random, seed = seeding.np_random(seed)
+        if self.np_random is None:
+            self.np_random = np_random
+        else:
+            # The random source is shared with the copies of the finite MDP models, which must follow the reseeding
+            self.np_random.set_state(np_random.get_state())
         return [seed]
 
     def plan(self, state, observation):
@@ -99,11 +492,87 @@ class AbstractPlanner(Configurable):
         """
         raise NotImplementedError()
 
+    def deadline(self):
+        """
+        :return: the time at which the current planning call must stop, or None if there is no time budget
+        """
+        return time.perf_counter() + self.config["time_budget"] if self.config["time_budget"] else None
+
+    @staticmethod
+    def deadline_reached(deadline):
+        """
+        :param deadline: a planning deadline
+        :return: whether the deadline is over, in which case the best plan found so far must be returned
+        """
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def ponder(self, state, observation, action):
+        """
+            Run a planning iteration in the subtree of the chosen action, while the environment is being stepped.
+
+        :param state: the environment state at the root of the tree, which must not be modified
+        :param observation: the corresponding observation
+        :param action: the chosen action
+        """
+        raise NotImplementedError()
+
+    def start_stats(self):
+        """
+            Start recording the statistics of a new planning call.
+        """
+        self.stats.reset()
+        if self.transpositions is not None:
+            self.transpositions.reset_statistics()
+        copies = {method: dict(stats) for method, stats in self.env_copier.stats.items()}
+        self.stats_start = (time.perf_counter(), copies)
+
+    def end_stats(self):
+        """
+            Complete the statistics of the planning call, and provide them to the hooks.
+
+            They always contain the number of iterations and the planning time, and when the instrumentation is
+            enabled:
+            - the numbers of nodes created and environment steps simulated;
+            - the time spent copying environments, simulating, selecting and backing up;
+            - the tree size and depth;
+            - the hits, misses, size and memory of the transposition table, if enabled.
+            - the number of nodes evicted to bound the tree size, if any.
+        """
+        start, copies = self.stats_start
+        values = self.stats.values
+        values["iterations"] = self.iterations_used
+        values["time"] = time.perf_counter() - start
+        if self.stats.enabled:
+            values["env_steps"] = values.get("simulate_count", 0)
+            values["copy_count"] = values["copy_time"] = 0
+            for method, stats in self.env_copier.stats.items():
+                previous = copies.get(method, dict(count=0, time=0))
+                values["copy_count"] += stats["count"] - previous["count"]
+                values["copy_time"] += stats["time"] - previous["time"]
+            values["tree_size"], values["tree_depth"] = self.tree_size_and_depth()
+            if self.transpositions is not None:
+                values.update(self.transpositions.statistics())
+        for hook in self.plan_hooks:
+            hook(self, values)
+
+    def tree_size_and_depth(self):
+        """
+        :return: the number of nodes of the tree, and its depth
+        """
+        size, depth = 0, 0
+        # Nodes shared through the transposition table are only counted once
+        for _, node_depth in depth_first(self.root, unique=True):
+            size += 1
+            depth = max(depth, node_depth)
+        return size, depth
+
     def get_plan(self):
         """
             Get the optimal action sequence of the current tree by recursively selecting the best action within each
             node with no exploration.
 
+            Nodes that maintain their best action during backups make this walk O(depth).
+
         :return: the list of actions
         """
         actions = []
@@ -128,10 +597,28 @@ class AbstractPlanner(Configurable):
             logger.warn("Unknown step strategy: {}".format(self.config["step_strategy"]))
             self.step_by_reset()
 
+    def set_root(self, root):
+        """
+            Replace the planner tree, e.g. by a copy of a cached tree.
+
+        :param root: the root of the new tree
+        """
+        self.root = root
+        if self.transpositions is not None:
+            self.transpositions.rebuild(self.root)
+
+    def close(self):
+        """
+            Release the resources of the planner, such as worker processes.
+        """
+        pass
+
     def step_by_reset(self):
         """
             Reset the planner tree to a root node for the new state.
         """
+        if self.transpositions is not None:
+            self.transpositions.clear()
         self.root = self.make_root()
 
     def step_by_subtree(self, action):
@@ -143,6 +630,8 @@ class AbstractPlanner(Configurable):
         if action in self.root.children:
             self.root = self.root.children[action]
             self.root.parent = None
+            if self.transpositions is not None:
+                self.transpositions.rebuild(self.root)
         else:
             # The selected action was never explored, start a new tree.
             self.step_by_reset()
@@ -152,16 +641,26 @@ class Node(object):
     """
         A tree node
     """
+    fingerprint = None
+    """ Fingerprint of the node state, once it is registered in the transposition table"""
 
-    def __init__(self, parent, planner):
+    def __init__(self, parent, planner, action=None):
         """
             New node.
 
         :param parent: its parent node
         :param planner: the planner using the node
+        :param action: the action leading from its parent to the node
         """
         self.parent = parent
         self.planner = planner
+        planner.stats.add("nodes_created")
+
+        self.action = action
+        """ Action label of the node in the children of its parent"""
+
+        self.depth = parent.depth + 1 if parent is not None else 0
+        """ Depth of the node, counted from the first root of the tree"""
 
         self.children = {}
         """ Dict of children nodes, indexed by action labels"""
@@ -177,7 +676,7 @@ class Node(object):
 
     def expand(self, branching_factor):
         for a in range(branching_factor):
-            self.children[a] = type(self)(self, self.planner)
+            self.children[a] = type(self)(self, self.planner, action=a)
 
     def selection_rule(self):
         raise NotImplementedError()
@@ -192,15 +691,16 @@ class Node(object):
         :param condition: nodes meeting that condition will be returned
         :return: list of paths to nodes that met the condition
         """
-        queue = [(root, [])]
+        # See also the traversal module, for lazy traversals without paths
+        queue = deque([(root, [])])
         while queue:
-            (node, path) = queue.pop(0)
+            (node, path) = queue.popleft()
             for next_key, next_node in node.children.items():
-                if (condition is None) or condition(next_node):
-                        returned = operator(next_node, path + [next_key]) if operator else (next_node, path + [next_key])
-                        yield returned
-                if (condition is None) or not condition(next_node):
-                        queue.append((next_node, path + [next_key]))
+                met = condition is None or condition(next_node)
+                if met:
+                    yield operator(next_node, path + [next_key]) if operator else (next_node, path + [next_key])
+                if condition is None or not met:
+                    queue.append((next_node, path + [next_key]))
 
     def is_leaf(self):
         return not self.children
@@ -212,10 +712,7 @@ class Node(object):
         node = self
         path = []
         while node.parent:
-            for a in node.parent.children:
-                if node.parent.children[a] == node:
-                    path.append(a)
-                    break
+            path.append(node.action)
             node = node.parent
         return reversed(path)
 
@@ -1,8 +1,8 @@
 import gym
 import numpy as np
 
-from rl_agents.agents.common import safe_deepcopy_env
 from rl_agents.agents.tree_search.abstract import Node, AbstractTreeSearchAgent, AbstractPlanner
+from rl_agents.agents.tree_search.traversal import breadth_first
 
 
 class DeterministicPlannerAgent(AbstractTreeSearchAgent):
@@ -18,46 +18,83 @@ class OptimisticDeterministicPlanner(AbstractPlanner):
        An implementation of Open Loop Optimistic Planning.
     """
     def __init__(self, config=None):
-        super(OptimisticDeterministicPlanner, self).__init__(config)
         self.leaves = None
+        self.pruned = None
+        super(OptimisticDeterministicPlanner, self).__init__(config)
 
     def make_root(self):
         root = DeterministicNode(None, planner=self)
         self.leaves = [root]
+        self.pruned = []
+        """ Leaves dominated by another node reaching the same state, that are not expanded"""
         return root
 
     def run(self):
         """
             Run an OptimisticDeterministicPlanner episode
         """
-        leaf_to_expand = max(self.leaves, key=lambda n: n.get_value_upper_bound())
+        with self.stats.timer("select"):
+            leaf_to_expand = max(self.leaves, key=lambda n: n.get_value_upper_bound())
         leaf_to_expand.expand(self.leaves)
 
-        self.root.backup_values()
+        with self.stats.timer("backup"):
+            self.root.backup_values()
 
     def plan(self, state, observation):
         self.root.state = state
+        deadline = self.deadline()
+        self.iterations_used = 0
         for _ in np.arange(self.config["budget"] // state.action_space.n):
             self.run()
+            self.iterations_used += 1
+            if self.deadline_reached(deadline):
+                break
 
         return self.get_plan()
 
+    def set_root(self, root):
+        super(OptimisticDeterministicPlanner, self).set_root(root)
+        self.leaves = [node for node, _ in breadth_first(root) if not node.children]
+        self.pruned = []
+
+    def step_by_reset(self):
+        if self.clone_pool:
+            self.release_states(self.root)
+        super(OptimisticDeterministicPlanner, self).step_by_reset()
+
     def step_by_subtree(self, action):
+        if self.clone_pool and action in self.root.children:
+            for other_action, child in self.root.children.items():
+                if other_action != action:
+                    self.release_states(child)
+                    self.release_env(child.state)
+            # The root state will be set to the true environment when planning
+            self.release_env(self.root.children[action].state)
+            self.root.children[action].state = None
         super(OptimisticDeterministicPlanner, self).step_by_subtree(action)
         if not self.root.children:
             self.leaves = [self.root]
         #  v0 = r0 + g r1 + g^2 r2 +... and v1 = r1 + g r2 + ... = (v0-r0)/g
-        for leaf in self.leaves:
+        for leaf in self.leaves + self.pruned:
             leaf.value = (leaf.value - self.root.reward) / self.config["gamma"]
             leaf.value_upper_bound = (leaf.value_upper_bound - self.root.reward) / self.config["gamma"]
         self.root.backup_values()
 
+    def release_states(self, node):
+        """
+            Give the states of all descendants of a node back to the clone pool.
+
+        :param node: a node, whose own state is kept
+        """
+        for child, depth in breadth_first(node):
+            if depth > 0:
+                self.release_env(child.state)
+
 
 class DeterministicNode(Node):
-    def __init__(self, parent, planner, state=None, depth=0):
-        super(DeterministicNode, self).__init__(parent, planner)
+    def __init__(self, parent, planner, state=None, action=None):
+        super(DeterministicNode, self).__init__(parent, planner, action)
         self.state = state
-        self.depth = depth
         self.reward = 0
         self.value_upper_bound = 0
         self.count = 1  # every node is explored exactly once
@@ -77,16 +114,47 @@ class DeterministicNode(Node):
             actions = self.state.get_available_actions()
         except AttributeError:
             actions = range(self.state.action_space.n)
+        leaves.remove(self)
         for action in actions:
             self.children[action] = type(self)(self,
                                                self.planner,
-                                               state=safe_deepcopy_env(self.state),
-                                               depth=self.depth + 1)
-            _, reward, done, _ = self.children[action].state.step(action)
+                                               state=self.planner.copy_env(self.state),
+                                               action=action)
+            with self.planner.stats.timer("simulate"):
+                observation, reward, done, _ = self.children[action].state.step(action)
             self.children[action].update(reward, done)
+            if self.planner.transpositions is None or not self.children[action].prune_transposition(observation, leaves):
+                leaves.append(self.children[action])
 
-        leaves.remove(self)
-        leaves.extend(self.children.values())
+    def prune_transposition(self, observation, leaves):
+        """
+            Look up the state of a new node in the transposition table, and prune dominated nodes.
+
+            The value of a node depends on the rewards collected along its path, so nodes reaching the same state at
+            the same depth cannot share their statistics. However, they share the same continuations, and the node
+            with the lowest value is dominated: it is not expanded further, and its upper bound is set to its value.
+
+        :param observation: the observation of the node state
+        :param leaves: the leaves of the tree, that may be expanded
+        :return: whether this node is dominated
+        """
+        planner = self.planner
+        depth = self.depth - planner.root.depth
+        other = planner.transpositions.find(self, depth, self.state, observation)
+        if other is None:
+            return False
+        if np.all(other.value >= self.value):
+            self.value_upper_bound = self.value
+            planner.pruned.append(self)
+            return True
+        if not np.all(self.value >= other.value):
+            return False
+        planner.transpositions.replace(self, depth)
+        if other in leaves:
+            leaves.remove(other)
+            other.value_upper_bound = other.value
+            planner.pruned.append(other)
+        return False
 
     def update(self, reward, done):
         if not np.all(0 <= reward) or not np.all(reward <= 1):
@@ -0,0 +1,168 @@
+import queue
+import threading
+
+import numpy as np
+from gym import logger
+
+from rl_agents.agents.tree_search.traversal import breadth_first
+
+FIELDS = dict(parent=np.int32,
+              action=np.int32,
+              count=np.int32,
+              value=np.float64,
+              upper_bound=np.float64,
+              prior=np.float64)
+""" Columns of an exported tree, with their dtype"""
+
+
+def tree_to_arrays(root):
+    """
+        Convert a tree to columns of node statistics, in breadth-first order.
+
+        The root has index 0 and a parent of -1, and every node comes after its parent. Statistics that a node does
+        not have, such as the prior of deterministic planning nodes, are set to NaN.
+        Nodes shared by several parents through a transposition table are only exported once, under their own parent.
+
+    :param root: the root of the tree
+    :return: a dict of arrays, indexed by field
+    """
+    nodes, parents, actions = [], [], []
+    indexes = {}
+    for node, depth in breadth_first(root, unique=True):
+        indexes[id(node)] = len(nodes)
+        nodes.append(node)
+        parents.append(indexes[id(node.parent)] if depth > 0 else -1)
+        actions.append(node.action if depth > 0 else -1)
+    columns = dict(parent=parents,
+                   action=actions,
+                   count=[node.count for node in nodes],
+                   value=[node.get_value() for node in nodes],
+                   upper_bound=[node.get_value_upper_bound() if hasattr(node, "get_value_upper_bound")
+                                else getattr(node, "mu_ucb", np.nan) for node in nodes],
+                   prior=[getattr(node, "prior", np.nan) for node in nodes])
+    return {field: np.array(columns[field], dtype=dtype) for field, dtype in FIELDS.items()}
+
+
+class TreeExporter(object):
+    """
+        Stream the trees of a planner to one file per episode.
+
+        The trees are converted to arrays when they are recorded, and stored in a background thread so as to keep
+        the planning loop cheap. Each file is an npz archive holding the concatenated columns of the trees of all
+        decisions of the episode, the offsets of each tree in these columns, and the time step of each decision.
+    """
+    def __init__(self, compress=False):
+        """
+        :param compress: whether the archives are compressed, which takes more time in the writer thread
+        """
+        self.compress = compress
+        self.trees = []
+        self.steps = []
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, planner, step=None):
+        """
+            Record the current tree of a planner.
+
+        :param planner: a tree search planner
+        :param step: the time step of the decision
+        """
+        self.queue.put(("tree", tree_to_arrays(planner.root), step))
+
+    def end_episode(self, path):
+        """
+            Write the trees recorded since the last episode.
+
+        :param path: the path of the episode file
+        """
+        self.queue.put(("write", path))
+
+    def close(self):
+        """
+            Wait for all files to be written, and stop the writer thread.
+        """
+        self.queue.put(("close",))
+        self.thread.join()
+
+    def write_loop(self):
+        while True:
+            message = self.queue.get()
+            if message[0] == "tree":
+                self.trees.append(message[1])
+                self.steps.append(message[2] if message[2] is not None else len(self.steps))
+            elif message[0] == "write":
+                self.write(message[1])
+            elif message[0] == "close":
+                break
+
+    def write(self, path):
+        if not self.trees:
+            return
+        offsets = np.cumsum([0] + [tree["parent"].size for tree in self.trees])
+        columns = {field: np.concatenate([tree[field] for tree in self.trees]) for field in FIELDS}
+        save = np.savez_compressed if self.compress else np.savez
+        try:
+            save(path, offsets=offsets, steps=np.array(self.steps), **columns)
+        except OSError as e:
+            logger.warn("Could not write the trees to {}: {}".format(path, e))
+        self.trees, self.steps = [], []
+
+
+def load_trees(path):
+    """
+        Load the trees of an episode file written by a TreeExporter.
+
+    :param path: the path of the episode file
+    :return: the list of (step, tree) of each decision, where each tree is a dict of arrays indexed by field
+    """
+    with np.load(path) as data:
+        offsets, steps = data["offsets"], data["steps"]
+        columns = {field: data[field] for field in FIELDS}
+    return [(steps[i], {field: columns[field][offsets[i]:offsets[i+1]] for field in FIELDS})
+            for i in range(len(steps))]
+
+
+class ExportedNode(object):
+    """
+        A node of a tree loaded from an exported file.
+
+        It can be displayed by TreeGraphics.display_node().
+    """
+    def __init__(self, parent, count, value, upper_bound, prior):
+        self.parent = parent
+        self.children = {}
+        self.count = count
+        self.value = value
+        self.value_upper_bound = upper_bound
+        self.prior = prior
+
+    def get_value(self):
+        return self.value
+
+    def get_value_upper_bound(self):
+        return self.value_upper_bound
+
+    def selection_rule(self):
+        if not self.children:
+            return None
+        # Tie best counts by best value
+        return max(self.children, key=lambda a: (self.children[a].count, self.children[a].value))
+
+
+def build_tree(tree):
+    """
+        Reconstruct the nodes of an exported tree.
+
+    :param tree: a dict of arrays indexed by field, as returned by load_trees()
+    :return: the root node
+    """
+    nodes = []
+    for i in range(tree["parent"].size):
+        parent = nodes[tree["parent"][i]] if tree["parent"][i] >= 0 else None
+        node = ExportedNode(parent, tree["count"][i], tree["value"][i], tree["upper_bound"][i], tree["prior"][i])
+        if parent is not None:
+            parent.children[int(tree["action"][i])] = node
+        nodes.append(node)
+    return nodes[0]
@@ -4,6 +4,7 @@ import matplotlib.cm as cm
 import numpy as np
 
 from rl_agents.agents.common import preprocess_env
+from rl_agents.agents.tree_search.traversal import depth_first
 
 
 class TreeGraphics(object):
@@ -23,10 +24,11 @@ class TreeGraphics(object):
         """
         cell_size = (surface.get_width() // (agent.planner.config['max_depth'] + 1), surface.get_height())
         pygame.draw.rect(surface, cls.BLACK, (0, 0, surface.get_width(), surface.get_height()), 0)
-        cls.display_node(agent.planner.root, agent.env.action_space, surface, (0, 0), cell_size,
-                         config=agent.planner.config, depth=0, selected=True)
-
-        actions = agent.planner.get_plan()
+        # The tree may be grown by a pondering thread while the environment is rendered
+        with agent.planner.tree_lock:
+            cls.display_node(agent.planner.root, agent.env.action_space, surface, (0, 0), cell_size,
+                             config=agent.planner.config, depth=0, selected=True)
+            actions = agent.planner.get_plan()
         font = pygame.font.Font(None, 13)
         text = font.render('-'.join(map(str, actions)), 1, (10, 10, 10), (255, 255, 255))
         surface.blit(text, (1, surface.get_height()-10))
@@ -48,29 +50,35 @@ class TreeGraphics(object):
         :param depth: the depth of the node in the tree
         :param selected: whether the node is within a selected branch of the tree
         """
-        # Display node value
-        cls.draw_node(node, surface, origin, size, config)
-
-        # Add selection display
-        if selected:
-            pygame.draw.rect(surface, cls.RED, (origin[0], origin[1], size[0], size[1]), 1)
-
-        if depth < 3:
-            cls.display_text(node, surface, origin, config)
-
-        # Recursively display children nodes
-        if depth >= config["max_depth"]:
-            return
-        try:
-            best_action = node.selection_rule()
-        except ValueError:
-            best_action = None
-        for a in node.children:
-            action_selected = (selected and (a == best_action))
-            cls.display_node(node.children[a], action_space, surface,
-                             (origin[0]+size[0], origin[1]+a*size[1]/action_space.n),
-                             (size[0], size[1]/action_space.n),
-                             depth=depth+1, config=config, selected=action_selected)
+        max_depth = config["max_depth"] - depth
+        # The best actions sequence from the node
+        best_path = []
+        best_node = node
+        while best_node.children and len(best_path) < max_depth:
+            try:
+                best_action = best_node.selection_rule()
+            except ValueError:
+                break
+            best_path.append(best_action)
+            best_node = best_node.children[best_action]
+        best_path = tuple(best_path)
+
+        for child, path in depth_first(node, max_depth=max_depth, paths=True):
+            # Each child is displayed next to its parent, in the row of its action
+            child_origin, child_size = origin, size
+            for a in path:
+                child_size = (size[0], child_size[1] / action_space.n)
+                child_origin = (child_origin[0] + size[0], child_origin[1] + a * child_size[1])
+
+            # Display node value
+            cls.draw_node(child, surface, child_origin, child_size, config)
+
+            # Add selection display
+            if selected and path == best_path[:len(path)]:
+                pygame.draw.rect(surface, cls.RED, (child_origin[0], child_origin[1], child_size[0], child_size[1]), 1)
+
+            if depth + len(path) < 3:
+                cls.display_text(child, surface, child_origin, config)
 
     @classmethod
     def draw_node(cls, node, surface, origin, size, config):
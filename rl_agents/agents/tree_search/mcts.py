@@ -1,9 +1,19 @@
+import multiprocessing
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from functools import partial
 from gym import logger
 
-from rl_agents.agents.common import safe_deepcopy_env
+from rl_agents.agents.common import safe_deepcopy_env, agent_factory
 from rl_agents.agents.tree_search.abstract import Node, AbstractTreeSearchAgent, AbstractPlanner
+from rl_agents.agents.tree_search.rollouts import RolloutEngine
+from rl_agents.agents.tree_search.traversal import breadth_first
+
+Descent = namedtuple("Descent", ["state", "observation", "node", "path", "total_reward", "depth", "terminal"])
 
 
 class MCTSAgent(AbstractTreeSearchAgent):
@@ -13,13 +23,62 @@ class MCTSAgent(AbstractTreeSearchAgent):
     def make_planner(self):
         prior_policy = MCTSAgent.policy_factory(self.config["prior_policy"])
         rollout_policy = MCTSAgent.policy_factory(self.config["rollout_policy"])
-        return MCTS(prior_policy, rollout_policy, self.config)
+        value_function = self.value_function_factory(self.config["value_estimator"]) \
+            if self.config["value_estimator"] else None
+        if self.config["root_workers"]:
+            return RootParallelMCTS(prior_policy, rollout_policy, self.config, value_function)
+        return MCTS(prior_policy, rollout_policy, self.config, value_function)
 
     @classmethod
     def default_config(cls):
-        return dict(prior_policy=dict(type="random_available"),
-                    rollout_policy=dict(type="random_available"),
-                    env_preprocessors=[])
+        """
+            The root_workers option enables root-parallel planning: when positive, this number of independent trees
+            are grown in worker processes, and their root statistics are merged.
+
+            The value_estimator option is the configuration of an agent estimating the values of the leaves, such as
+            an AbstractDQNAgent, which must contain a '__class__' key and may contain a 'model_save' path to load.
+        """
+        config = super(MCTSAgent, cls).default_config()
+        config.update(dict(prior_policy=dict(type="random_available"),
+                           rollout_policy=dict(type="random_available"),
+                           root_workers=0,
+                           value_estimator={}))
+        return config
+
+    def batch_config(self):
+        config = super(MCTSAgent, self).batch_config()
+        # The batch workers are daemonic processes, which cannot start worker processes of their own
+        config["root_workers"] = 0
+        config["rollout_workers"] = 0
+        if self.config["value_estimator"]:
+            path = self.save_batch_model(self.value_estimator, "value_estimator")
+            if path:
+                config["value_estimator"]["model_save"] = path
+        return config
+
+    def value_function_factory(self, estimator_config):
+        """
+            Create the value function of the leaves from an agent that estimates the values of states.
+
+        :param estimator_config: the configuration of the agent, which must implement get_batch_state_values()
+        :return: a function of a list of observations returning the array of their values
+        """
+        self.value_estimator = agent_factory(self.env, estimator_config)
+        if "model_save" in estimator_config:
+            self.value_estimator.load(estimator_config["model_save"])
+        return partial(MCTSAgent.estimated_values, self.value_estimator)
+
+    @staticmethod
+    def estimated_values(estimator, observations):
+        """
+            Estimate the values of a batch of observations with a single call of an estimator agent.
+
+        :param estimator: an agent implementing get_batch_state_values()
+        :param observations: the list of observations
+        :return: the array of their values
+        """
+        values, _ = estimator.get_batch_state_values(observations)
+        return np.asarray(values)
 
     @staticmethod
     def policy_factory(policy_config):
@@ -92,54 +151,251 @@ class MCTS(AbstractPlanner):
     """
        An implementation of Monte-Carlo Tree Search, with Upper Confidence Tree exploration.
     """
-    def __init__(self, prior_policy, rollout_policy, config=None):
+    def __init__(self, prior_policy, rollout_policy, config=None, value_function=None):
         """
             New MCTS instance.
 
         :param config: the mcts configuration. Use default if None.
         :param prior_policy: the prior policy used when expanding and selecting nodes
         :param rollout_policy: the rollout policy used to estimate the value of a leaf node
+        :param value_function: a function estimating the values of a list of observations, used to evaluate the
+                               leaves after a truncated rollout, if any
         """
+        self.prior_epoch = 0
+        """ Number of steps by prior, whose conversions of visit counts are applied lazily to the visited nodes"""
         super(MCTS, self).__init__(config)
         self.config["iterations"] = self.config["budget"] // self.config["max_depth"]
         self.prior_policy = prior_policy
         self.rollout_policy = rollout_policy
+        self.value_function = value_function
+        self.batch_prior_policy = None
+        """ A function of lists of states and observations returning their prior distributions with a single call,
+            used to expand the leaves of a wave at once, if any"""
+        self.batch_rollout_policy = None
+        """ A function of lists of states and observations returning their rollout distributions with a single call,
+            used to step the rollouts of a wave at once, if any"""
+        self.executor = None
+        self.rollouts = RolloutEngine(self.config["rollout_workers"], self.stats) \
+            if self.config["rollouts_per_leaf"] > 1 or self.config["rollout_leaves"] > 1 \
+            or self.config["rollout_workers"] or self.value_function is not None else None
+        """ Evaluates the leaves with batches of rollouts, if enabled"""
+        self.steps_saved = 0
+        """ Number of simulator steps saved by the value function during the last planning call"""
+        self.evicted_nodes = 0
+        """ Total number of nodes evicted to bound the tree size"""
 
     @classmethod
     def default_config(cls):
+        """
+            The tree_workers option enables tree-parallel planning: when positive, this number of worker threads
+            descend the shared tree concurrently, and each pending descent adds virtual_loss visits with zero return
+            to the traversed nodes so as to steer the other workers away from the same branches.
+
+            With transpositions, the tree becomes a DAG in which the children reaching the same state share a node.
+            The statistics of each action are then stored on the edges, in the children arrays of the parent, and
+            virtual losses are not used.
+
+            The max_nodes option bounds the number of nodes of the tree, which otherwise keeps growing across decisions
+            with the subtree and prior step strategies. When it is exceeded, the least visited subtrees are evicted
+            until an eviction_fraction of max_nodes is freed.
+
+            The rollouts options enable batched leaf evaluations: each leaf is evaluated by the average return of
+            rollouts_per_leaf rollouts, and the iterations are run in waves of rollout_leaves descents, separated by
+            virtual losses, whose rollouts are all stepped at once. The rollouts may be run in rollout_workers
+            processes. When the planner has batch policies, the priors of the leaves of a wave and
+            the rollout actions of each of its steps are also evaluated with a single call.
+
+            With a value function, the rollouts are truncated to rollout_depth steps, and the value of their last
+            state is estimated for all the leaves of a wave at once. This value is added to the rewards of the
+            rollout, undiscounted like the rest of the returns.
+
+            The widening_coefficient option enables progressive widening, for large action sets: the children of a
+            node are created in order of decreasing prior probability, as its visit count n grows, so that it has
+            ceil(widening_coefficient * n ^ widening_exponent) children.
+
+            The early_stopping option ends the planning call as soon as the best root action is settled, which is
+            checked every early_stopping_period iterations:
+            - "visits": the visit count gap between the two most visited actions exceeds the remaining iterations, so
+              that the most visited action cannot be overtaken;
+            - "confidence": the most visited action also has the best value, and the lower confidence bound of its
+              value exceeds the upper confidence bounds of the other actions, with a probability of error
+              early_stopping_delta. The returns are assumed to lie in [0, max_depth], as with rewards in [0, 1].
+        """
         d = super(MCTS, cls).default_config()
-        d.update(dict(temperature=40))
+        d.update(dict(temperature=40,
+                      tree_workers=0,
+                      virtual_loss=1,
+                      max_nodes=None,
+                      eviction_fraction=0.1,
+                      rollouts_per_leaf=1,
+                      rollout_leaves=1,
+                      rollout_workers=0,
+                      rollout_depth=0,
+                      early_stopping=None,
+                      early_stopping_period=10,
+                      early_stopping_delta=0.05,
+                      widening_coefficient=None,
+                      widening_exponent=0.5))
         return d
 
     def make_root(self):
+        self.node_count = 1
         return MCTSNode(parent=None, planner=self)
 
-    def run(self, state, observation):
+    def run(self, state, observation, root_action=None):
         """
             Run an iteration of Monte-Carlo Tree Search, starting from a given state
 
         :param state: the initial environment state
         :param observation: the corresponding observation
+        :param root_action: if set, the first action to take instead of sampling it
+        """
+        virtual_loss = self.config['virtual_loss'] \
+            if self.config['tree_workers'] and self.transpositions is None else 0
+        descent = self.descend(state, observation, root_action, virtual_loss)
+        if self.rollouts is not None:
+            value = self.evaluate_leaves([descent])[0]
+        else:
+            value = self.evaluate(state, descent.observation, limit=descent.depth) \
+                if not np.all(descent.terminal) else 0
+        self.backup(descent, value, virtual_loss)
+
+    def descend(self, state, observation, root_action=None, virtual_loss=0, expand=True):
+        """
+            Select actions from the root down to a leaf while simulating them, and expand the leaf.
+
+        :param state: the initial environment state, which is stepped
+        :param observation: the corresponding observation
+        :param root_action: if set, the first action to take instead of sampling it
+        :param virtual_loss: the virtual loss added to the traversed nodes
+        :param expand: whether the leaf is expanded, or left to a batched expansion with expand_leaves()
+        :return: the Descent, with the leaf reached and its state
         """
         node = self.root
         total_reward = 0
         depth = self.config['max_depth']
         terminal = False
+        path = []
+        if node.epoch != self.prior_epoch:
+            with self.tree_lock:
+                node.refresh()
         while depth > 0 and node.children and not np.all(terminal):
-            action = node.sampling_rule(temperature=self.config['temperature'])
-            observation, reward, terminal, _ = state.step(action)
+            with self.tree_lock, self.stats.timer("select"):
+                if node.pending_actions:
+                    node.widen()
+                if node is self.root and root_action in node.children:
+                    action = root_action
+                else:
+                    action = node.sampling_rule(temperature=self.config['temperature'])
+                parent, node = node, node.children[action]
+                if node.epoch != self.prior_epoch:
+                    node.refresh()
+                if virtual_loss:
+                    node.add_virtual_loss(virtual_loss)
+            with self.stats.timer("simulate"):
+                observation, reward, terminal, _ = state.step(action)
             total_reward += reward
-            node = node.children[action]
             depth = depth - 1
+            if self.transpositions is not None:
+                path.append((parent, action, reward))
+                with self.tree_lock:
+                    node = self.transpose(parent, action, node, self.config['max_depth'] - depth, state, observation)
+                    if node.epoch != self.prior_epoch:
+                        node.refresh()
+
+        if expand and self.expandable(node, depth, terminal):
+            actions_distribution = self.prior_policy(state, observation)
+            with self.tree_lock:
+                node.expand(actions_distribution)
+        return Descent(state, observation, node, path, total_reward, depth, terminal)
+
+    def expandable(self, node, depth, terminal):
+        """
+            Whether the leaf reached by a descent must be expanded.
+
+        :param node: the leaf node
+        :param depth: the remaining depth of the descent
+        :param terminal: whether the leaf state is terminal
+        """
+        return not node.children and depth > 0 and (not np.all(terminal) or node == self.root)
+
+    def expand_leaves(self, descents):
+        """
+            Expand the leaves of several descents, whose prior distributions are evaluated with a single call of the
+            batch prior policy.
+
+            A leaf reached by several descents is only evaluated once.
+
+        :param descents: the list of descents, whose states must not be stepped yet
+        """
+        leaves = {}
+        for descent in descents:
+            if id(descent.node) not in leaves and self.expandable(descent.node, descent.depth, descent.terminal):
+                leaves[id(descent.node)] = descent
+        if not leaves:
+            return
+        leaves = list(leaves.values())
+        with self.stats.timer("inference"):
+            distributions = self.batch_prior_policy([descent.state for descent in leaves],
+                                                    [descent.observation for descent in leaves])
+        self.stats.add("inference_observations", len(leaves))
+        with self.tree_lock:
+            for descent, actions_distribution in zip(leaves, distributions):
+                descent.node.expand(actions_distribution)
 
-        if not node.children \
-                and depth > 0 \
-                and (not np.all(terminal) or node == self.root):
-            node.expand(self.prior_policy(state, observation))
+    def backup(self, descent, value, virtual_loss=0):
+        """
+            Back up the return of an iteration.
+
+        :param descent: the descent of the iteration
+        :param value: the return-to-go sampled from its leaf
+        :param virtual_loss: the virtual loss added during the descent, to be removed
+        """
+        with self.tree_lock, self.stats.timer("backup"):
+            if self.transpositions is not None:
+                self.update_path(descent.path, descent.node, value)
+            else:
+                descent.node.update_branch(descent.total_reward + value, virtual_loss=virtual_loss)
 
-        if not np.all(terminal):
-            total_reward = self.evaluate(state, observation, total_reward, limit=depth)
-        node.update_branch(total_reward)
+    def transpose(self, parent, action, node, depth, state, observation):
+        """
+            When a node is reached for the first time, look up its state in the transposition table.
+
+            If another node at the same depth already reached this state, the action is redirected to it.
+
+        :param parent: the parent node
+        :param action: the action taken from the parent
+        :param node: the node reached
+        :param depth: the depth of the node
+        :param state: the environment state reached
+        :param observation: the corresponding observation
+        :return: the node representing the state reached
+        """
+        if node.fingerprint is not None or node.count > 0:
+            return node
+        other = self.transpositions.find(node, depth, state, observation)
+        if other is None:
+            return node
+        parent.redirect_child(action, other)
+        return other
+
+    @staticmethod
+    def update_path(path, leaf, value):
+        """
+            Back up the return of a trajectory along the path that was followed in the DAG of nodes.
+
+            Since nodes may be reached by several action sequences, they estimate their return-to-go rather than the
+            return since the root, and the edges of the path are updated in the children arrays of their parent.
+
+        :param path: the list of (parent, action, reward) edges followed from the root
+        :param leaf: the last node reached
+        :param value: the return-to-go sampled from the leaf
+        """
+        leaf.update(value)
+        for parent, action, reward in reversed(path):
+            value += reward
+            parent.update_child(action, value)
+            parent.update(value)
 
     def evaluate(self, state, observation, total_reward=0, limit=10):
         """
@@ -154,19 +410,294 @@ class MCTS(AbstractPlanner):
         for _ in range(limit):
             actions, probabilities = self.rollout_policy(state, observation)
             action = self.np_random.choice(actions, 1, p=np.array(probabilities))[0]
-            observation, reward, terminal, _ = state.step(action)
+            with self.stats.timer("simulate"):
+                observation, reward, terminal, _ = state.step(action)
             total_reward += reward
             if np.all(terminal):
                 break
         return total_reward
 
+    def evaluate_leaves(self, descents):
+        """
+            Evaluate the leaves of several descents with a single batch of rollouts.
+
+            Each leaf is evaluated by the average return of rollouts_per_leaf rollouts, run from copies of its state,
+            and by the value function of their last state if any.
+
+        :param descents: the list of descents
+        :return: the array of return-to-go sampled from each leaf
+        """
+        rollouts_per_leaf = self.config["rollouts_per_leaf"]
+        states, observations, limits, leaves, copies = [], [], [], [], []
+        # The first scratch slots hold the states of the descents
+        slot = self.config["rollout_leaves"]
+        for i, descent in enumerate(descents):
+            if np.all(descent.terminal) or descent.depth == 0:
+                continue
+            snapshot = self.env_copier.snapshot(descent.state) if rollouts_per_leaf > 1 else None
+            for j in range(rollouts_per_leaf):
+                if j == 0:
+                    state = descent.state
+                else:
+                    state = self.scratch_env(descent.state, snapshot, slot=slot)
+                    slot += 1
+                    copies.append(state)
+                states.append(state)
+                observations.append(descent.observation)
+                limits.append(descent.depth if self.value_function is None
+                              else min(descent.depth, self.config["rollout_depth"]))
+                leaves.append(i)
+        values = np.zeros(len(descents))
+        if states:
+            returns, observations, terminals = self.rollouts.evaluate(self.rollout_policy, states, observations, limits,
+                                                                      self.np_random, self.batch_rollout_policy)
+            if self.value_function is not None:
+                self.estimate_values(returns, observations, terminals, limits, [descents[i] for i in leaves])
+            np.add.at(values, leaves, returns / rollouts_per_leaf)
+        for state in copies:
+            self.release_env(state)
+        return values
+
+    def estimate_values(self, returns, observations, terminals, limits, descents):
+        """
+            Add the values of the last states of truncated rollouts, estimated with a single call of the value function.
+
+        :param returns: the array of total rewards of the rollouts, which is updated
+        :param observations: the last observations of the rollouts
+        :param terminals: whether the rollouts reached a terminal state
+        :param limits: the number of steps of the rollouts
+        :param descents: the descent from which each rollout started
+        """
+        truncated = np.flatnonzero(~np.asarray(terminals))
+        if not truncated.size:
+            return
+        with self.stats.timer("estimate"):
+            returns[truncated] += self.value_function([observations[i] for i in truncated])
+        # A full rollout would have simulated every remaining step of the descent
+        self.steps_saved += sum(descents[i].depth - limits[i] for i in truncated)
+
     def plan(self, state, observation):
+        self.steps_saved = 0
+        if self.rollouts is not None:
+            self.rollouts.reset_stats()
+        if self.config['tree_workers']:
+            return self.plan_in_parallel(state, observation)
+        if self.config['rollout_leaves'] > 1:
+            return self.plan_in_waves(state, observation)
+        snapshot = self.env_copier.snapshot(state)
+        deadline = self.deadline()
+        self.iterations_used = 0
         for i in range(self.config['iterations']):
             if (i+1) % 10 == 0:
                 logger.debug('{} / {}'.format(i+1, self.config['iterations']))
-            self.run(safe_deepcopy_env(state), observation)
+            self.run_copy(state, snapshot, observation)
+            self.iterations_used += 1
+            self.bound_tree_size()
+            if self.deadline_reached(deadline) or self.should_stop(self.iterations_used):
+                break
         return self.get_plan()
 
+    def should_stop(self, iterations, new_iterations=1):
+        """
+            Check the early stopping rule, if enabled, when a checking period is completed.
+
+        :param iterations: the number of iterations run so far
+        :param new_iterations: the number of iterations run since the last check
+        :return: whether the planning call can be stopped
+        """
+        period = self.config["early_stopping_period"]
+        if not self.config["early_stopping"] or iterations // period == (iterations - new_iterations) // period:
+            return False
+        return self.decision_settled(self.config["iterations"] - iterations)
+
+    def decision_settled(self, remaining):
+        """
+            Whether the best root action can no longer change, according to the early stopping rule.
+
+        :param remaining: the number of iterations remaining in the budget
+        :return: whether the best root action is settled
+        """
+        root = self.root
+        if not root.children:
+            return False
+        if len(root.children) == 1 and not root.pending_actions:
+            return True
+        counts = root.child_counts
+        if counts.size < 2:
+            # The other actions are still pending in progressive widening
+            return False
+        best = root.best_slot
+        others = np.arange(counts.size) != best
+        if self.config["early_stopping"] == "visits":
+            return counts[best] - np.amax(counts[others]) > remaining
+        elif self.config["early_stopping"] == "confidence":
+            values = root.child_values
+            if np.argmax(values) != best:
+                return False
+            # Hoeffding bounds, with a union bound over the actions
+            with np.errstate(divide='ignore'):
+                widths = self.config["max_depth"] * np.sqrt(np.log(2 * counts.size / self.config["early_stopping_delta"])
+                                                            / (2 * counts))
+            return values[best] - widths[best] > np.amax(values[others] + widths[others])
+        raise ValueError("Unknown early stopping rule: {}".format(self.config["early_stopping"]))
+
+    def plan_in_waves(self, state, observation):
+        """
+            Run the planning iterations in waves of descents, whose leaves are evaluated with a single batch of
+            rollouts.
+
+            Each descent of a wave adds virtual losses to the nodes that it traverses, so as to steer the next descents
+            of the wave away from the same branches. With a batch prior policy, the expansion of the leaves is deferred
+            to the end of the wave, so that their priors are evaluated at once.
+
+        :param state: the initial environment state
+        :param observation: the corresponding observation
+        :return: the actions sequence
+        """
+        snapshot = self.env_copier.snapshot(state)
+        deadline = self.deadline()
+        virtual_loss = self.config['virtual_loss'] if self.transpositions is None else 0
+        batch_expansion = self.batch_prior_policy is not None
+        self.iterations_used = 0
+        while self.iterations_used < self.config['iterations']:
+            size = min(self.config['rollout_leaves'], self.config['iterations'] - self.iterations_used)
+            descents = [self.descend(self.scratch_env(state, snapshot, slot=i), observation,
+                                     virtual_loss=virtual_loss, expand=not batch_expansion) for i in range(size)]
+            if batch_expansion:
+                self.expand_leaves(descents)
+            for descent, value in zip(descents, self.evaluate_leaves(descents)):
+                self.backup(descent, value, virtual_loss)
+                self.release_env(descent.state)
+            self.iterations_used += size
+            self.bound_tree_size()
+            if self.deadline_reached(deadline) or self.should_stop(self.iterations_used, size):
+                break
+        return self.get_plan()
+
+    def end_stats(self):
+        if self.rollouts is not None:
+            self.stats.values.update(rollouts=self.rollouts.stats["rollouts"],
+                                     rollout_steps=self.rollouts.stats["steps"],
+                                     rollout_time=self.rollouts.stats["time"],
+                                     rollout_steps_per_second=self.rollouts.stats["steps_per_second"])
+        if self.value_function is not None:
+            self.stats.values["simulator_steps_saved"] = self.steps_saved
+        if self.stats.values.get("inference_time"):
+            self.stats.values["inference_observations_per_second"] = \
+                self.stats.values["inference_observations"] / self.stats.values["inference_time"]
+        super(MCTS, self).end_stats()
+
+    def close(self):
+        """
+            Stop the rollout worker processes and the tree-parallel worker threads.
+        """
+        if self.rollouts is not None:
+            self.rollouts.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def run_copy(self, state, snapshot, observation):
+        """
+            Run an iteration of Monte-Carlo Tree Search from a copy of a given state.
+
+        :param state: the initial environment state
+        :param snapshot: a snapshot of this state, if available
+        :param observation: the corresponding observation
+        """
+        state_copy = self.scratch_env(state, snapshot)
+        self.run(state_copy, observation)
+        self.release_env(state_copy)
+
+    def ponder(self, state, observation, action):
+        state_copy = self.scratch_env(state)
+        self.run(state_copy, observation, root_action=action)
+        self.release_env(state_copy)
+        self.bound_tree_size()
+
+    def plan_in_parallel(self, state, observation):
+        """
+            Run the planning iterations in a pool of worker threads sharing the same tree.
+
+        :param state: the initial environment state
+        :param observation: the corresponding observation
+        :return: the actions sequence
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.config['tree_workers'])
+        snapshot = self.env_copier.snapshot(state)
+        deadline = self.deadline()
+        settled = threading.Event()
+
+        def iteration(i):
+            if i > 0 and (self.deadline_reached(deadline) or settled.is_set()):
+                return False
+            self.run_copy(state, snapshot, observation)
+            # Iterations are started in order, so at least i + 1 iterations have been run or are ongoing
+            if self.should_stop(i + 1):
+                settled.set()
+            return True
+        # Wait for all iterations, and raise their exceptions
+        self.iterations_used = sum(self.executor.map(iteration, range(self.config['iterations'])))
+        # Descents hold references to the nodes they traverse, so the tree is only bounded once they are over
+        self.bound_tree_size()
+        return self.get_plan()
+
+    def bound_tree_size(self):
+        """
+            Evict subtrees if the tree has more nodes than allowed.
+        """
+        if self.config["max_nodes"] and self.node_count > self.config["max_nodes"]:
+            with self.tree_lock:
+                self.evict(int(self.config["max_nodes"] * (1 - self.config["eviction_fraction"])))
+
+    def evict(self, target):
+        """
+            Collapse the least visited subtrees into leaves, until the tree has at most a target number of nodes.
+
+            The statistics of the evicted nodes are folded into the collapsed nodes, whose count and value already
+            aggregate all the trajectories of their subtree, and which keep their statistics in the children arrays
+            of their parent. A collapsed node is expanded again if later iterations reach it.
+
+        :param target: the number of nodes to keep
+        :return: the number of evicted nodes
+        """
+        nodes = [node for node, _ in breadth_first(self.root, unique=True)]
+        sizes = {}
+        for node in reversed(nodes):
+            sizes[id(node)] = 1 + sum(sizes.get(id(child), 0) for child in node.children.values()
+                                      if child.parent is node)
+
+        # Collapse the least visited and least valuable nodes first
+        excess = len(nodes) - target
+        collapsed = set()
+        candidates = [node for node in nodes[1:] if node.children]
+        # The visit counts of nodes with pending conversions to priors are to be reset
+        for node in sorted(candidates, key=lambda n: (n.count if n.epoch == self.prior_epoch else 0, n.get_value())):
+            if excess <= 0:
+                break
+            ancestors = []
+            ancestor = node.parent
+            while ancestor is not None and id(ancestor) not in collapsed:
+                ancestors.append(ancestor)
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                continue  # Already evicted with a collapsed ancestor
+            freed = sizes[id(node)] - 1
+            node.collapse()
+            collapsed.add(id(node))
+            excess -= freed
+            for ancestor in ancestors:
+                sizes[id(ancestor)] -= freed
+
+        if self.transpositions is not None:
+            self.transpositions.rebuild(self.root)
+        self.node_count, _ = self.tree_size_and_depth()
+        evicted = len(nodes) - self.node_count
+        self.evicted_nodes += evicted
+        self.stats.add("evicted_nodes", evicted)
+        return evicted
+
     def step(self, action):
         if self.config["step_strategy"] == "prior":
             self.step_by_prior(action)
@@ -178,27 +709,249 @@ class MCTS(AbstractPlanner):
             Replace the MCTS tree by its subtree corresponding to the chosen action, but also convert the visit counts
             to prior probabilities and before resetting them.
 
+            The conversion is lazy: a new epoch is started, and each node converts its visit counts when it is next
+            visited, so that only the visited nodes of the subtree are rewritten.
+
         :param action: a chosen action from the root node
         """
         self.step_by_subtree(action)
-        self.root.convert_visits_to_prior_in_branch()
+        self.prior_epoch += 1
+
+    def get_plan(self):
+        # The tree may be grown by a pondering thread meanwhile
+        with self.tree_lock:
+            actions = []
+            node = self.root
+            while True:
+                if node.epoch != self.prior_epoch:
+                    node.refresh()
+                if not node.children:
+                    return actions
+                action = node.selection_rule()
+                actions.append(action)
+                node = node.children[action]
+
+    def step_by_subtree(self, action):
+        super(MCTS, self).step_by_subtree(action)
+        if self.config["max_nodes"]:
+            self.node_count, _ = self.tree_size_and_depth()
+
+    def set_root(self, root):
+        # Apply the conversions pending in the restored tree, and bring its nodes to the current epoch
+        nodes = [node for node, _ in breadth_first(root, unique=True)]
+        tree_epoch = max(node.epoch for node in nodes)
+        for node in nodes:
+            node.refresh(tree_epoch)
+            node.epoch = self.prior_epoch
+        super(MCTS, self).set_root(root)
+        if self.config["max_nodes"]:
+            self.node_count, _ = self.tree_size_and_depth()
+
+
+class RootParallelMCTS(MCTS):
+    """
+        Root-parallel Monte-Carlo Tree Search.
+
+        Independent MCTS trees are grown from the same state in a pool of worker processes with different seeds,
+        and the visit counts and values of their root children are merged before selecting the action.
+        The workers are kept alive between planning calls, and each of them steps its own tree.
+    """
+    def __init__(self, prior_policy, rollout_policy, config=None, value_function=None):
+        self.connections = []
+        self.processes = []
+        self.worker_seeds = []
+        self.worker_stats = []
+        """ Throughput of each worker during the last planning call"""
+        super(RootParallelMCTS, self).__init__(prior_policy, rollout_policy, config, value_function)
+
+    def seed(self, seed=None):
+        seeds = super(RootParallelMCTS, self).seed(seed)
+        self.worker_seeds = [int(worker_seed)
+                             for worker_seed in self.np_random.randint(2**31, size=self.config["root_workers"])]
+        for connection, worker_seed in zip(self.connections, self.worker_seeds):
+            connection.send(("seed", worker_seed))
+        return seeds
+
+    def start_workers(self):
+        """
+            Start the worker processes, each with its own MCTS planner.
+        """
+        config = dict(self.config, root_workers=0)
+        for worker_seed in self.worker_seeds:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=root_parallel_worker,
+                                              args=(worker_connection, self.prior_policy, self.rollout_policy,
+                                                    config, worker_seed, self.value_function),
+                                              daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def close(self):
+        """
+            Stop the worker processes.
+        """
+        for connection in self.connections:
+            connection.send(("close",))
+        for process in self.processes:
+            process.join()
+        self.connections, self.processes = [], []
+        super(RootParallelMCTS, self).close()
+
+    def plan(self, state, observation):
+        if not self.connections:
+            self.start_workers()
+        state = safe_deepcopy_env(state)
+        for connection in self.connections:
+            connection.send(("plan", state, observation))
+        results = [connection.recv() for connection in self.connections]
+
+        counts, value_sums = defaultdict(int), defaultdict(float)
+        self.worker_stats = []
+        self.iterations_used = 0
+        for actions, child_counts, child_values, iterations, elapsed in results:
+            self.iterations_used += iterations
+            for action, count, value in zip(actions, child_counts, child_values):
+                counts[action] += count
+                value_sums[action] += count * value
+            self.worker_stats.append(dict(iterations=iterations,
+                                          time=elapsed,
+                                          iterations_per_second=iterations / elapsed if elapsed else np.inf))
+        self.merge_roots(counts, value_sums)
+        return self.get_plan()
+
+    def merge_roots(self, counts, value_sums):
+        """
+            Replace the tree by a root whose children statistics aggregate those of all workers.
+
+        :param counts: the total visit count of each root action
+        :param value_sums: the total return of each root action
+        """
+        self.root = self.make_root()
+        actions = list(counts.keys())
+        if not actions:
+            return
+        self.root.add_children((actions, np.ones(len(actions)) / len(actions)))
+        for action in actions:
+            child = self.root.children[action]
+            child.count = counts[action]
+            child.value = value_sums[action] / counts[action] if counts[action] else 0
+            child.write_statistics()
+        self.root.count = sum(counts.values())
+
+    def step(self, action):
+        for connection in self.connections:
+            connection.send(("step", action))
+
+    def step_by_reset(self):
+        super(RootParallelMCTS, self).step_by_reset()
+        for connection in self.connections:
+            connection.send(("reset",))
+
+    def set_root(self, root):
+        # The workers trees cannot be restored, start new ones.
+        super(RootParallelMCTS, self).set_root(root)
+        for connection in self.connections:
+            connection.send(("reset",))
+
+
+def root_parallel_worker(connection, prior_policy, rollout_policy, config, seed, value_function=None):
+    """
+        Serve planning requests of a RootParallelMCTS planner, in a worker process.
+
+    :param connection: the connection to the main process
+    :param prior_policy: the prior policy used when expanding and selecting nodes
+    :param rollout_policy: the rollout policy used to estimate the value of a leaf node
+    :param config: the mcts configuration
+    :param seed: the seed of the worker planner
+    :param value_function: the value function of the leaves, if any
+    """
+    planner = MCTS(prior_policy, rollout_policy, config, value_function)
+    planner.seed(seed)
+    while True:
+        message = connection.recv()
+        command, args = message[0], message[1:]
+        if command == "plan":
+            start = time.time()
+            planner.plan(*args)
+            elapsed = time.time() - start
+            root = planner.root
+            if root.children:
+                connection.send((root.child_actions, root.child_counts, root.child_values,
+                                 planner.iterations_used, elapsed))
+            else:
+                connection.send(([], [], [], planner.iterations_used, elapsed))
+        elif command == "step":
+            planner.step(*args)
+        elif command == "reset":
+            planner.step_by_reset()
+        elif command == "seed":
+            planner.seed(*args)
+        elif command == "close":
+            break
+    connection.close()
 
 
 class MCTSNode(Node):
     K = 1.0
     """ The value function first-order filter gain"""
 
-    def __init__(self, parent, planner, prior=1):
-        super(MCTSNode, self).__init__(parent, planner)
+    def __init__(self, parent, planner, prior=1, action=None):
+        super(MCTSNode, self).__init__(parent, planner, action)
         self.prior = prior
 
+        self.slot = None
+        """ Index of the node statistics in the arrays of its parent"""
+
+        self.virtual_loss = 0
+        """ Number of visits of ongoing tree-parallel descents through this node, not backed up yet"""
+
+        self.child_actions = []
+        """ Actions of the children nodes, in the order of the children statistics arrays"""
+
+        self.child_counts = self.child_values = self.child_priors = None
+        """ Contiguous arrays of the children visit counts, values and prior probabilities"""
+
+        self.pending_actions = None
+        """ Actions and prior probabilities of the children not created yet by progressive widening"""
+
+        self.best_slot = None
+        """ Slot of the child with maximum visit count, maintained when the children statistics are written"""
+
+        self.epoch = planner.prior_epoch
+        """ Epoch of the planner in which the visit counts of the node were last converted to prior probabilities"""
+
     def selection_rule(self):
         if not self.children:
             return None
+        return self.child_actions[self.best_slot]
+
+    def find_best_slot(self):
+        """
+            Find the child with maximum visit count, tied by best value and then by lowest slot.
+        """
         # Tie best counts by best value
-        actions = list(self.children.keys())
-        counts = Node.all_argmax([self.children[a].count for a in actions])
-        return actions[max(counts, key=(lambda i: self.children[actions[i]].get_value()))]
+        counts = Node.all_argmax(self.child_counts)
+        self.best_slot = counts[np.argmax(self.child_values[counts])]
+
+    def update_best_slot(self, slot, previous_count, previous_value):
+        """
+            Update the best child after the statistics of a child were written.
+
+            The best child can only change to the updated child, unless the best child itself was downgraded, in which
+            case all children are compared again.
+
+        :param slot: the slot of the updated child
+        :param previous_count: its visit count before the update
+        :param previous_value: its value before the update
+        """
+        best = self.best_slot
+        if slot == best:
+            if (self.child_counts[slot], self.child_values[slot]) < (previous_count, previous_value):
+                self.find_best_slot()
+        elif (self.child_counts[slot], self.child_values[slot], -slot) > \
+                (self.child_counts[best], self.child_values[best], -best):
+            self.best_slot = slot
 
     def sampling_rule(self, temperature=None):
         """
@@ -210,9 +963,8 @@ class MCTSNode(Node):
         :return: the selected action
         """
         if self.children:
-            actions = list(self.children.keys())
             # Randomly tie best candidates with respect to selection strategy
-            return actions[self.random_argmax([self.children[a].selection_strategy(temperature) for a in actions])]
+            return self.child_actions[self.random_argmax(self.children_selection_strategy(temperature))]
         else:
             return None
 
@@ -220,12 +972,73 @@ class MCTSNode(Node):
         """
             Expand a leaf node by creating a new child for each available action.
 
+            With progressive widening, the actions are instead sorted by decreasing prior probability, and their
+            children are only created as the visit count of the node grows, see widen().
+
         :param actions_distribution: the list of available actions and their prior probabilities
         """
+        if self.planner.config["widening_coefficient"]:
+            actions, probabilities = actions_distribution
+            order = np.argsort(-np.asarray(probabilities, dtype=float), kind="stable")
+            self.pending_actions = [(actions[i], probabilities[i]) for i in order if actions[i] not in self.children]
+            self.widen()
+        else:
+            self.add_children(actions_distribution)
+
+    def widen(self):
+        """
+            Create the children of the most probable pending actions, up to the number of children allowed by the
+            visit count n of the node: ceil(widening_coefficient * n ^ widening_exponent), and at least one.
+        """
+        if not self.pending_actions:
+            return
+        config = self.planner.config
+        allowed = max(int(np.ceil(config["widening_coefficient"] * self.count ** config["widening_exponent"])), 1)
+        new_children = allowed - len(self.child_actions)
+        if new_children <= 0:
+            return
+        actions, probabilities = zip(*self.pending_actions[:new_children])
+        self.pending_actions = self.pending_actions[new_children:]
+        self.add_children((actions, probabilities))
+
+    def add_children(self, actions_distribution):
+        """
+            Create a new child for each of a list of actions, if it does not exist yet.
+
+        :param actions_distribution: the list of actions and their prior probabilities
+        """
         actions, probabilities = actions_distribution
+        new_actions, new_priors = [], []
         for i in range(len(actions)):
             if actions[i] not in self.children:
-                self.children[actions[i]] = type(self)(self, self.planner, probabilities[i])
+                child = type(self)(self, self.planner, probabilities[i], action=actions[i])
+                child.slot = len(self.child_actions) + len(new_actions)
+                self.children[actions[i]] = child
+                new_actions.append(actions[i])
+                new_priors.append(child.prior)
+        if not new_actions:
+            return
+        self.planner.node_count += len(new_actions)
+        self.child_actions.extend(new_actions)
+        if self.child_counts is None:
+            self.child_counts = np.zeros(len(new_actions), dtype=int)
+            self.child_values = np.zeros(len(new_actions))
+            self.child_priors = np.array(new_priors, dtype=float)
+        else:
+            self.child_counts = np.append(self.child_counts, np.zeros(len(new_actions), dtype=int))
+            self.child_values = np.append(self.child_values, np.zeros(len(new_actions)))
+            self.child_priors = np.append(self.child_priors, new_priors)
+        self.find_best_slot()
+
+    def collapse(self):
+        """
+            Remove the children of the node, which keeps its own statistics.
+        """
+        self.children = {}
+        self.child_actions = []
+        self.child_counts = self.child_values = self.child_priors = None
+        self.best_slot = None
+        self.pending_actions = None
 
     def update(self, total_reward):
         """
@@ -236,15 +1049,67 @@ class MCTSNode(Node):
         self.count += 1
         self.value += self.K / self.count * (total_reward - self.value)
 
-    def update_branch(self, total_reward):
+    def update_branch(self, total_reward, virtual_loss=0):
         """
             Update the whole branch from this node to the root with the total reward of the corresponding trajectory.
 
+            The statistics of each node are also written in the children arrays of its parent.
+
         :param total_reward: the total reward obtained through a trajectory passing by this node
+        :param virtual_loss: the virtual loss added to the branch nodes during their descent, to be removed
         """
         self.update(total_reward)
         if self.parent:
-            self.parent.update_branch(total_reward)
+            self.virtual_loss -= virtual_loss
+            self.write_statistics()
+            self.parent.update_branch(total_reward, virtual_loss)
+
+    def update_child(self, action, total_reward):
+        """
+            Update the visit count and value of an action in the children arrays, given a sample of total reward.
+
+        :param action: the action taken from this node
+        :param total_reward: the total reward obtained through a trajectory taking this action
+        """
+        slot = self.child_actions.index(action)
+        previous_count, previous_value = self.child_counts[slot], self.child_values[slot]
+        self.child_counts[slot] += 1
+        self.child_values[slot] += self.K / self.child_counts[slot] * (total_reward - self.child_values[slot])
+        self.update_best_slot(slot, previous_count, previous_value)
+
+    def redirect_child(self, action, node):
+        """
+            Make an action lead to an existing node that reached the same state, instead of its own child.
+
+            The statistics of the action are kept in the children arrays, and the node keeps its first parent.
+
+        :param action: the action taken from this node
+        :param node: the node shared with other parents
+        """
+        dict.__setitem__(self.children, action, node)
+
+    def add_virtual_loss(self, virtual_loss):
+        """
+            Count pending visits of the node with zero return, until they are backed up.
+
+        :param virtual_loss: the number of pending visits
+        """
+        self.virtual_loss += virtual_loss
+        self.write_statistics()
+
+    def write_statistics(self):
+        """
+            Write the node statistics, including pending virtual losses, into the children arrays of its parent.
+        """
+        previous_count, previous_value = self.parent.child_counts[self.slot], self.parent.child_values[self.slot]
+        if self.virtual_loss:
+            count = self.count + self.virtual_loss
+            self.parent.child_counts[self.slot] = count
+            self.parent.child_values[self.slot] = self.value * self.count / count
+        else:
+            self.parent.child_counts[self.slot] = self.count
+            self.parent.child_values[self.slot] = self.value
+        self.parent.update_best_slot(self.slot, previous_count, previous_value)
 
     def selection_strategy(self, temperature):
         """
@@ -259,6 +1124,15 @@ class MCTSNode(Node):
         # return self.value + temperature * self.prior * np.sqrt(np.log(self.parent.count) / self.count)
         return self.get_value() + temperature*self.prior/(self.count+1)
 
+    def children_selection_strategy(self, temperature):
+        """
+            Vectorized selection strategy of all children, computed from the children statistics arrays.
+
+        :param temperature: the exploration parameter, positive or zero.
+        :return: the array of children values with exploration bonus
+        """
+        return self.child_values + temperature * self.child_priors / (self.child_counts + 1)
+
     def convert_visits_to_prior_in_branch(self, regularization=0.5):
         """
             For any node in the subtree, convert the distribution of all children visit counts to prior
@@ -268,10 +1142,37 @@ class MCTSNode(Node):
                                when 0, the prior is a Boltzmann distribution of visit counts
                                when 1, the prior is a uniform distribution
         """
-        self.count = 0
-        total_count = sum([(child.count+1) for child in self.children.values()])
+        self.convert_visits_to_prior(regularization)
         for child in self.children.values():
-            child.prior = regularization*(child.count+1)/total_count + regularization/len(self.children)
-            child.convert_visits_to_prior_in_branch()
+            child.convert_visits_to_prior_in_branch(regularization)
+
+    def convert_visits_to_prior(self, regularization=0.5):
+        """
+            Convert the distribution of the children visit counts to prior probabilities, and reset the visit counts.
+
+        :param regularization: in [0, 1], used to add some probability mass to all children.
+        """
+        self.count = 0
+        if not self.children:
+            return
+        total_count = np.sum(self.child_counts + 1)
+        self.child_priors = regularization*(self.child_counts+1)/total_count + regularization/len(self.children)
+        self.child_counts[:] = 0
+        self.find_best_slot()
+        # The slot of a child shared through the transposition table indexes the arrays of its first parent only
+        for action, prior in zip(self.child_actions, self.child_priors):
+            self.children[action].prior = prior
 
+    def refresh(self, epoch=None):
+        """
+            Apply the conversions of visit counts to prior probabilities of the epochs started since the last visit.
+
+            The visit counts are reset by the first conversion, after which the conversions always give the same
+            priors, so at most two of them are applied.
 
+        :param epoch: the epoch to reach, that of the planner by default
+        """
+        epoch = self.planner.prior_epoch if epoch is None else epoch
+        for _ in range(min(epoch - self.epoch, 2)):
+            self.convert_visits_to_prior()
+        self.epoch = epoch
@@ -30,11 +30,24 @@ class MCTSWithPriorPolicyAgent(MCTSAgent):
             self.config)
         self.planner.prior_policy = self.agent_policy_available
         self.planner.rollout_policy = self.agent_policy_available
+        if hasattr(self.prior_agent, "get_batch_state_action_values"):
+            self.planner.batch_prior_policy = self.batch_priors
+            self.planner.batch_rollout_policy = self.batch_priors
+
+    def make_planner(self):
+        if self.config.get("rollout_workers"):
+            raise ValueError("The rollout policy of the prior agent cannot be sent to rollout worker processes, "
+                             "rollout_workers must be 0")
+        return super(MCTSWithPriorPolicyAgent, self).make_planner()
 
     @classmethod
     def default_config(cls):
         """
-            Use the PyTorch implementation of a DQN Agent as default prior agent
+            Use the PyTorch implementation of a DQN Agent as default prior agent.
+
+            Batched evaluations of the prior agent are opt-in: with rollout_leaves > 1, the planning iterations are run
+            in waves of rollout_leaves descents, and a prior agent implementing get_batch_state_action_values()
+            evaluates the observations of the leaves and rollouts of a wave in batches.
         :return: the default MCTSWithPriorPolicyAgent config
         """
         mcts_config = super(MCTSWithPriorPolicyAgent, cls).default_config()
@@ -44,16 +57,33 @@ class MCTSWithPriorPolicyAgent(MCTSAgent):
         }})
         return mcts_config
 
+    def batch_config(self):
+        config = super(MCTSWithPriorPolicyAgent, self).batch_config()
+        path = self.save_batch_model(self.prior_agent, "prior_agent")
+        if path:
+            config["prior_agent"]["model_save"] = path
+        return config
+
     def agent_policy(self, state, observation):
         # Reset prior agent environment
         self.prior_agent.env = state
-        # Trigger the computation of action distribution
-        self.prior_agent.act(observation)
         distribution = self.prior_agent.action_distribution(observation)
         return list(distribution.keys()), list(distribution.values())
 
     def agent_policy_available(self, state, observation):
         actions, probs = self.agent_policy(state, observation)
+        return self.available_distribution(state, actions, probs)
+
+    @staticmethod
+    def available_distribution(state, actions, probs):
+        """
+            Restrict an action distribution to the actions available in a state.
+
+        :param state: the environment state
+        :param actions: the actions of the distribution
+        :param probs: their probabilities
+        :return: the available actions, and their normalized probabilities
+        """
         if hasattr(state, 'get_available_actions'):
             available_actions = state.get_available_actions()
             probs = np.array([probs[actions.index(a)] for a in available_actions])
@@ -61,6 +91,21 @@ class MCTSWithPriorPolicyAgent(MCTSAgent):
             actions = available_actions
         return actions, probs
 
+    def batch_priors(self, states, observations):
+        """
+            Evaluate the prior policy of a batch of states with a single batched call of the prior agent, if supported.
+
+            It is used for the roots of batch planning calls, and for the leaves and rollouts of the planning waves.
+        """
+        if not hasattr(self.prior_agent, "get_batch_state_action_values"):
+            return None
+        priors = []
+        for state, values in zip(states, self.prior_agent.get_batch_state_action_values(observations)):
+            self.prior_agent.exploration_policy.update(values)
+            distribution = self.prior_agent.exploration_policy.get_distribution()
+            priors.append(self.available_distribution(state, list(distribution.keys()), list(distribution.values())))
+        return priors
+
     def record(self, state, action, reward, next_state, done):
         raise NotImplementedError()
 
@@ -69,3 +114,5 @@ class MCTSWithPriorPolicyAgent(MCTSAgent):
 
     def load(self, filename):
         self.prior_agent.load(filename)
+        # The batch planning copies must load the new model
+        self.close_batch()
@@ -0,0 +1,77 @@
+import numpy as np
+from gym import spaces
+
+from rl_agents.agents.dynamic_programming.value_iteration import ValueIterationAgent
+
+
+def get_finite_mdp(env, convert=False):
+    """
+        Get the finite MDP describing the dynamics of an environment, if any.
+
+    :param env: an environment
+    :param convert: whether environments that are not finite MDPs but can be converted to one with to_finite_mdp()
+                    are also supported
+    :return: the finite MDP, whose state is the current state of the environment, or None
+    """
+    if ValueIterationAgent.is_finite_mdp(env.unwrapped):
+        return env.unwrapped.mdp
+    elif convert and hasattr(env, "to_finite_mdp"):
+        return env.to_finite_mdp()
+    return None
+
+
+class FiniteMDPModel(object):
+    """
+        A model of a finite MDP, that can be simulated by the planners in place of the environment.
+
+        Its state is the integer index of the MDP state, and its transitions are lookups in the transition, reward
+        and terminal arrays of the MDP, so that copying it is cheap. In the stochastic mode, the next states are
+        sampled from the transition probabilities with the random source of the planner.
+
+        As in the ValueIterationAgent, the limit on the number of steps of an episode is not modelled.
+    """
+    def __init__(self, mdp, state=None, np_random=None, cumulative_transition=None):
+        """
+        :param mdp: a finite MDP, with transition, reward, terminal and mode attributes
+        :param state: the initial state index, the current state of the MDP if None
+        :param np_random: the random source used to sample stochastic transitions
+        :param cumulative_transition: the cumulative transition probabilities, computed if None
+        """
+        self.mdp = mdp
+        self.state = mdp.state if state is None else state
+        self.np_random = np_random or np.random
+        self.action_space = spaces.Discrete(mdp.transition.shape[1])
+        self.stochastic = mdp.mode == "stochastic"
+        if self.stochastic and cumulative_transition is None:
+            cumulative_transition = np.cumsum(mdp.transition, axis=-1)
+        self.cumulative_transition = cumulative_transition
+
+    def step(self, action):
+        """
+            Perform a transition of the MDP.
+
+        :param action: the action index
+        :return: the next state index, the reward, whether the state was terminal, and an empty info dict
+        """
+        reward = self.mdp.reward[self.state, action]
+        terminal = self.mdp.terminal[self.state]
+        if self.stochastic:
+            cumulative = self.cumulative_transition[self.state, action]
+            self.state = min(int(np.searchsorted(cumulative, self.np_random.rand() * cumulative[-1], side="right")),
+                             cumulative.size - 1)
+        else:
+            self.state = int(self.mdp.transition[self.state, action])
+        return self.state, reward, terminal, {}
+
+    def get_state(self):
+        return self.state
+
+    def set_state(self, state):
+        self.state = state
+
+    def clone(self):
+        return FiniteMDPModel(self.mdp, self.state, self.np_random, self.cumulative_transition)
+
+    @property
+    def unwrapped(self):
+        return self
@@ -1,8 +1,8 @@
 from gym import logger
 import numpy as np
 
-from rl_agents.agents.common import safe_deepcopy_env
 from rl_agents.agents.tree_search.abstract import Node, AbstractTreeSearchAgent, AbstractPlanner
+from rl_agents.agents.tree_search.traversal import breadth_first
 from rl_agents.agents.utils import bernoulli_kullback_leibler, hoeffding_upper_bound, kl_upper_bound
 
 
@@ -22,6 +22,10 @@ class OLOP(AbstractPlanner):
         self.leaves = None
         self.env = env
         super(OLOP, self).__init__(config)
+        if self.transpositions is not None:
+            logger.warn("OLOP plans open-loop sequences of actions without observing states, "
+                        "so it does not support transpositions")
+            self.transpositions = None
 
     @classmethod
     def default_config(cls):
@@ -41,6 +45,10 @@ class OLOP(AbstractPlanner):
 
         return root
 
+    def set_root(self, root):
+        super(OLOP, self).set_root(root)
+        self.leaves = [node for node, _ in breadth_first(root) if not node.children]
+
     def prebuild_tree(self, branching_factor):
         """
             Build a full search tree with a given branching factor and depth.
@@ -80,12 +88,13 @@ class OLOP(AbstractPlanner):
 
         :param state: the initial environment state
         """
-        # Compute B-values
-        list(Node.breadth_first_search(self.root, operator=self.compute_u_values, condition=None))
-        sequences_upper_bounds = list(map(OLOP.sharpen_b_values, self.leaves))
+        with self.stats.timer("select"):
+            # Compute B-values
+            self.compute_u_values()
+            sequences_upper_bounds = list(map(OLOP.sharpen_b_values, self.leaves))
 
-        # Pick best sequence of actions
-        best_sequence = list(self.leaves[np.argmax(sequences_upper_bounds)].path())
+            # Pick best sequence of actions
+            best_sequence = list(self.leaves[np.argmax(sequences_upper_bounds)].path())
 
         if self.config["lazy_tree_construction"]:
             # If the sequence length is shorter than the horizon, all continuations have the same upper-bounds.
@@ -95,34 +104,39 @@ class OLOP(AbstractPlanner):
         # Execute sequence, expand tree if needed, collect rewards and update upper confidence bounds.
         node = self.root
         for action in best_sequence:
-            observation, reward, done, _ = state.step(action)
+            with self.stats.timer("simulate"):
+                observation, reward, done, _ = state.step(action)
             if not node.children:
                 self.leaves = node.expand(state, self.leaves, update_children=True)
             if action not in node.children:  # Default action may not be available
                 action = node.children.keys()[0]  # Pick first available action
             node = node.children[action]
-            node.update(reward, done)
+            with self.stats.timer("backup"):
+                node.update(reward, done)
             if node.done:
                 break
 
-    def compute_u_values(self, node, path):
+    def compute_u_values(self):
         """
-            Compute the upper bound value of the action sequence at a given node.
+            Compute the upper bound value of the action sequences at all nodes but the root.
 
             It represents the maximum admissible reward over trajectories that start with this particular sequence.
             It is computed by summing upper bounds of intermediate rewards along the sequence, and an upper bound
             of the remaining rewards over possible continuations of the sequence.
-        :param node: a node in the look-ahead tree
-        :param path: the path from the root to the node
-        :return: the path from the root to the node, and the node value.
+            The sums of intermediate upper bounds are accumulated from the root down, since the breadth-first
+            traversal reaches every parent before its children.
         """
-        # Upper bound of the reward-to-go after this node
-        node.value = self.config["gamma"] ** (len(path) + 1) / (1 - self.config["gamma"]) if not node.done else 0
-        node_t = node
-        for t in np.arange(len(path), 0, -1):  # from current node up to the root
-            node.value += self.config["gamma"]**t * node_t.mu_ucb  # upper bound of the node mean reward
-            node_t = node_t.parent
-        return path, node.value
+        gamma = self.config["gamma"]
+        rewards_bounds = {id(self.root): 0}
+        for node, depth in breadth_first(self.root):
+            if depth == 0:
+                continue
+            # Upper bound of the discounted rewards until this node, with the node mean reward upper bound
+            rewards_bound = rewards_bounds[id(node.parent)] + gamma ** depth * node.mu_ucb
+            if node.children:
+                rewards_bounds[id(node)] = rewards_bound
+            # Upper bound of the reward-to-go after this node
+            node.value = rewards_bound + (gamma ** (depth + 1) / (1 - gamma) if not node.done else 0)
 
     @staticmethod
     def sharpen_b_values(node):
@@ -145,10 +159,18 @@ class OLOP(AbstractPlanner):
             return min_value
 
     def plan(self, state, observation):
+        snapshot = self.env_copier.snapshot(state)
+        deadline = self.deadline()
+        self.iterations_used = 0
         for i in range(self.config['episodes']):
             if (i+1) % 10 == 0:
                 logger.debug('{} / {}'.format(i+1, self.config['episodes']))
-            self.run(safe_deepcopy_env(state))
+            state_copy = self.scratch_env(state, snapshot)
+            self.run(state_copy)
+            self.release_env(state_copy)
+            self.iterations_used += 1
+            if self.deadline_reached(deadline):
+                break
 
         return self.get_plan()
 
@@ -156,8 +178,8 @@ class OLOP(AbstractPlanner):
 class OLOPNode(Node):
     STOP_ON_ANY_TERMINAL_STATE = False
 
-    def __init__(self, parent, planner):
-        super(OLOPNode, self).__init__(parent, planner)
+    def __init__(self, parent, planner, action=None):
+        super(OLOPNode, self).__init__(parent, planner, action)
 
         self.cumulative_reward = 0
         """ Sum of all rewards received at this node. """
@@ -196,11 +218,17 @@ class OLOPNode(Node):
             actions = state.get_available_actions()
         except AttributeError:
             actions = range(state.action_space.n)
+        snapshot = self.planner.env_copier.snapshot(state) if update_children else None
         for action in actions:
             self.children[action] = type(self)(self,
-                                               self.planner)
+                                               self.planner,
+                                               action=action)
             if update_children:
-                _, reward, done, _ = safe_deepcopy_env(state).step(action)
+                # The state is itself a scratch copy of the root state, use another slot
+                state_copy = self.planner.scratch_env(state, snapshot, slot=1)
+                with self.planner.stats.timer("simulate"):
+                    _, reward, done, _ = state_copy.step(action)
+                self.planner.release_env(state_copy)
                 self.children[action].update(reward, done)
 
         idx = leaves.index(self)
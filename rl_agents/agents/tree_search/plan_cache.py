@@ -0,0 +1,126 @@
+import copy
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+from gym import logger
+
+from rl_agents.agents.tree_search.transposition import fingerprint_factory
+from rl_agents.agents.tree_search.traversal import depth_first
+
+
+class PlanCache(object):
+    """
+        A least-recently-used cache of the plans of a tree search agent, indexed by root state.
+
+        It assumes that the planner returns the same plan whenever it starts from the same state with the same
+        configuration, so that repeated evaluations can skip planning. The trees of the plans may also be cached, so
+        that the planner can keep stepping them as if it had planned.
+    """
+    def __init__(self, config, size=1000, fingerprint="observation", subtrees=False, path=None):
+        """
+        :param config: the planner configuration, part of the cache keys
+        :param size: the maximum number of cached plans, the least recently used being evicted first
+        :param fingerprint: the fingerprint function of the root states, see fingerprint_factory()
+        :param subtrees: whether the planner trees are cached with the plans
+        :param path: a file in which the plans are persisted across processes, if any
+        """
+        self.config_key = json.dumps(config, sort_keys=True, default=str)
+        self.size = size
+        self.fingerprint = fingerprint_factory(fingerprint)
+        self.subtrees = subtrees
+        self.path = path
+        self.entries = OrderedDict()
+        """ The cached (actions, tree) entries, from least to most recently used"""
+        self.hits = 0
+        self.misses = 0
+        self.modified = False
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def key(self, state, observation):
+        """
+        :param state: the root environment state
+        :param observation: the corresponding observation
+        :return: the key of the plan starting from this state
+        """
+        return self.fingerprint(state, observation), self.config_key
+
+    def get(self, key):
+        """
+            Get a cached plan.
+
+        :param key: the key of the root state
+        :return: the list of actions and a copy of the tree, if cached, or None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        actions, tree = entry
+        return list(actions), self.copy_tree(tree) if tree is not None else None
+
+    def put(self, key, actions, planner):
+        """
+            Cache a plan, and evict the least recently used plan if the cache is full.
+
+        :param key: the key of the root state
+        :param actions: the list of actions
+        :param planner: the planner, whose tree is cached if enabled
+        """
+        tree = self.copy_tree(planner.root) if self.subtrees else None
+        self.entries[key] = (list(actions), tree)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        self.modified = True
+
+    @staticmethod
+    def copy_tree(root):
+        """
+            Copy the nodes of a tree, while sharing the planner that they refer to.
+
+            The environment states stored in the nodes, if any, are copied by the planner env copier rather than deep
+            copied with their viewer. The root state is not copied, since it is set to the true environment when
+            planning.
+
+        :param root: the root of the tree
+        :return: the root of the copy
+        """
+        planner = root.planner
+        memo = {id(planner): planner}
+        if getattr(root, "state", None) is not None:
+            memo[id(root.state)] = None
+        for node, _ in depth_first(root, unique=True):
+            state = getattr(node, "state", None)
+            if state is not None and id(state) not in memo:
+                memo[id(state)] = planner.env_copier.copy(state)
+        return copy.deepcopy(root, memo=memo)
+
+    def save(self):
+        """
+            Write the cached plans to the cache file, without their trees.
+        """
+        if not self.path or not self.modified:
+            return
+        temporary_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temporary_path, 'wb') as f:
+            pickle.dump([(key, actions) for key, (actions, _) in self.entries.items()], f)
+        os.replace(temporary_path, self.path)
+        self.modified = False
+
+    def load(self):
+        """
+            Read the cached plans from the cache file.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                for key, actions in pickle.load(f):
+                    self.entries[key] = (actions, None)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warn("Could not load the plan cache from {}: {}".format(self.path, e))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
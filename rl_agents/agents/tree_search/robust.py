@@ -51,6 +51,7 @@ class DiscreteRobustPlanner(OptimisticDeterministicPlanner):
     def make_root(self):
         root = RobustNode(parent=None, planner=self)
         self.leaves = [root]
+        self.pruned = []
         return root
 
 
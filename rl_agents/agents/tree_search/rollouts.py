@@ -0,0 +1,166 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+from rl_agents.agents.tree_search.stats import PlannerStats
+
+
+class RolloutEngine(object):
+    """
+        Evaluate many leaves of a planner tree at once, with batches of rollouts.
+
+        In the planner process, the environment copies of all rollouts are stepped in lockstep, and the actions of a
+        step are sampled for all rollouts with a single draw of the random source. The rollouts may also be split
+        between worker processes, in which case the environment copies and the rollout policy must be picklable.
+    """
+    def __init__(self, workers=0, stats=None):
+        """
+        :param workers: the number of worker processes, or 0 to run the rollouts in the planner process
+        :param stats: the planner statistics, in which the simulation time is recorded
+        """
+        self.workers = workers
+        self.planner_stats = stats or PlannerStats()
+        self.pool = None
+        self.stats = dict(rollouts=0, steps=0, time=0, steps_per_second=0)
+        """ Throughput of the rollouts since the last reset"""
+
+    def reset_stats(self):
+        self.stats = dict(rollouts=0, steps=0, time=0, steps_per_second=0)
+
+    def evaluate(self, rollout_policy, states, observations, limits, np_random, batch_policy=None):
+        """
+            Run a rollout from each of a batch of states.
+
+        :param rollout_policy: the rollout policy, a function of a state and observation returning actions and their
+                               probabilities
+        :param states: the environment states, which are stepped
+        :param observations: the corresponding observations
+        :param limits: the maximum number of simulation steps of each rollout
+        :param np_random: the random source used to sample the actions, and the seeds of the workers
+        :param batch_policy: if set, a function of lists of states and observations returning the actions and
+                             probabilities of each of them with a single call, used instead of the rollout policy
+        :return: the array of total rewards of the rollouts, the list of their last observations, and the array of
+                 whether they reached a terminal state
+        """
+        start = time.perf_counter()
+        if self.workers and len(states) > 1:
+            returns, observations, terminals, steps = self.evaluate_in_workers(rollout_policy, states, observations,
+                                                                               limits, np_random, batch_policy)
+            self.planner_stats.add("simulate_count", steps)
+        else:
+            observations = list(observations)
+            returns, terminals, steps = lockstep_rollouts(rollout_policy, states, observations, limits, np_random,
+                                                          self.planner_stats, batch_policy)
+        self.stats["rollouts"] += len(states)
+        self.stats["steps"] += steps
+        self.stats["time"] += time.perf_counter() - start
+        self.stats["steps_per_second"] = self.stats["steps"] / self.stats["time"] if self.stats["time"] else np.inf
+        return returns, observations, terminals
+
+    def evaluate_in_workers(self, rollout_policy, states, observations, limits, np_random, batch_policy=None):
+        """
+            Split a batch of rollouts between the worker processes.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        chunks = min(self.workers, len(states))
+        seeds = np_random.randint(2**31, size=chunks)
+        results = self.pool.starmap(rollouts_in_worker,
+                                    [(rollout_policy, states[i::chunks], observations[i::chunks], limits[i::chunks],
+                                      int(seeds[i]), batch_policy) for i in range(chunks)])
+        returns, observations, terminals = np.zeros(len(states)), [None] * len(states), np.zeros(len(states), bool)
+        for i, (chunk_returns, chunk_observations, chunk_terminals, _) in enumerate(results):
+            returns[i::chunks] = chunk_returns
+            observations[i::chunks] = chunk_observations
+            terminals[i::chunks] = chunk_terminals
+        return returns, observations, terminals, sum(result[-1] for result in results)
+
+    def close(self):
+        """
+            Stop the worker processes.
+        """
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def sample_actions(distributions, np_random):
+    """
+        Sample an action from each of a list of distributions, with a single draw of the random source.
+
+    :param distributions: the list of (actions, probabilities) of each distribution
+    :param np_random: the random source
+    :return: the list of sampled actions
+    """
+    uniforms = np_random.rand(len(distributions))
+    sizes = {len(probabilities) for _, probabilities in distributions}
+    if len(sizes) == 1:
+        cumulative = np.cumsum([probabilities for _, probabilities in distributions], axis=1)
+        indexes = np.sum(cumulative <= uniforms[:, np.newaxis] * cumulative[:, -1:], axis=1)
+        indexes = np.minimum(indexes, sizes.pop() - 1)
+    else:
+        indexes = []
+        for (_, probabilities), uniform in zip(distributions, uniforms):
+            cumulative = np.cumsum(probabilities)
+            indexes.append(min(np.searchsorted(cumulative, uniform * cumulative[-1], side="right"),
+                               len(cumulative) - 1))
+    return [actions[index] for (actions, _), index in zip(distributions, indexes)]
+
+
+def lockstep_rollouts(rollout_policy, states, observations, limits, np_random, stats=None, batch_policy=None):
+    """
+        Run rollouts from a batch of states, stepping all of them at each simulation step.
+
+    :param rollout_policy: the rollout policy
+    :param states: the environment states, which are stepped
+    :param observations: the corresponding observations, which are replaced by the observations reached
+    :param limits: the maximum number of simulation steps of each rollout
+    :param np_random: the random source used to sample the actions
+    :param stats: the planner statistics, in which the simulation and inference times are recorded
+    :param batch_policy: if set, a function of lists of states and observations returning the actions and
+                         probabilities of each of them, used instead of the rollout policy to evaluate the policy of all
+                         the rollouts of a step at once
+    :return: the array of total rewards of the rollouts, the array of whether they reached a terminal state, and the
+             total number of simulation steps
+    """
+    stats = stats or PlannerStats()
+    returns = np.zeros(len(states))
+    terminals = np.zeros(len(states), dtype=bool)
+    remaining = list(limits)
+    active = [i for i in range(len(states)) if remaining[i] > 0]
+    steps = 0
+    while active:
+        if batch_policy is not None:
+            with stats.timer("inference"):
+                distributions = batch_policy([states[i] for i in active], [observations[i] for i in active])
+            stats.add("inference_observations", len(active))
+        else:
+            distributions = [rollout_policy(states[i], observations[i]) for i in active]
+        actions = sample_actions(distributions, np_random)
+        still_active = []
+        for i, action in zip(active, actions):
+            with stats.timer("simulate"):
+                observations[i], reward, terminal, _ = states[i].step(action)
+            returns[i] += reward
+            remaining[i] -= 1
+            steps += 1
+            terminals[i] = np.all(terminal)
+            if remaining[i] > 0 and not terminals[i]:
+                still_active.append(i)
+        active = still_active
+    return returns, terminals, steps
+
+
+def rollouts_in_worker(rollout_policy, states, observations, limits, seed, batch_policy=None):
+    """
+        Run a chunk of a batch of rollouts, in a worker process.
+
+    :return: the total rewards of the rollouts, their last observations, whether they reached a terminal state, and
+             the total number of simulation steps
+    """
+    observations = list(observations)
+    returns, terminals, steps = lockstep_rollouts(rollout_policy, states, observations, limits,
+                                                  np.random.RandomState(seed), batch_policy=batch_policy)
+    return returns, observations, terminals, steps
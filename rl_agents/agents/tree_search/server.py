@@ -0,0 +1,227 @@
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict, namedtuple
+from functools import partial
+from multiprocessing.connection import Listener, Client
+
+from gym import logger
+
+from rl_agents.agents.common import agent_factory
+
+Request = namedtuple("Request", ["connection", "lock", "request_id", "config_key", "payload"])
+
+_agents = {}
+""" The warm agents of a worker process, indexed by configuration"""
+
+
+def plan_requests(config_key, payloads):
+    """
+        Plan for a batch of requests sharing the same agent configuration, with a warm agent.
+
+    :param config_key: the agent configuration, serialized to JSON
+    :param payloads: the pickled (env, observation, seed) of each request
+    :return: the ("ok", actions) or ("error", message) result of each request
+    """
+    results = []
+    for payload in payloads:
+        try:
+            env, observation, seed = pickle.loads(payload)
+            agent = _agents.get(config_key)
+            if agent is None:
+                agent = _agents[config_key] = agent_factory(env, json.loads(config_key))
+            agent.env = env
+            agent.reset()
+            if seed is not None:
+                agent.seed(seed)
+            results.append(("ok", list(agent.plan(observation))))
+        except Exception as e:
+            results.append(("error", repr(e)))
+    return results
+
+
+class PlanningServer(object):
+    """
+        A local server planning decisions for clients.
+
+        Clients send the configuration of an agent, a pickled environment state and its observation, and receive the
+        plan of the agent. Since the requests are unpickled, clients must authenticate with the server authkey.
+        Concurrent requests are gathered in batches, and the requests of a batch that share the same configuration
+        are split between a pool of worker processes, which keep a warm agent for each configuration.
+    """
+    def __init__(self, address=("localhost", 0), workers=4, batch_size=16, batch_delay=0.002, authkey=None):
+        """
+        :param address: a (host, port) TCP address, or the path of a Unix socket
+        :param workers: the number of worker processes, or 0 to plan in the server process
+        :param batch_size: the maximum number of requests in a batch
+        :param batch_delay: the maximum time waited for other requests after the first request of a batch [s]
+        :param authkey: the authentication key that clients must provide, randomly generated if None
+        """
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.pool = multiprocessing.Pool(workers) if workers else None
+        self.requests = queue.Queue()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.stats = dict(requests=0, batches=0)
+
+    def start(self):
+        """
+            Start accepting and serving requests in background threads.
+
+        :return: the server
+        """
+        for target in [self.accept_loop, self.batch_loop]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def serve_forever(self):
+        self.start()
+        self.stopped.wait()
+
+    def close(self):
+        self.stopped.set()
+        try:
+            # Wake the accepting thread up, without waiting for an authentication challenge in case it already stopped
+            if isinstance(self.address, tuple):
+                socket.create_connection(self.address).close()
+            else:
+                with socket.socket(socket.AF_UNIX) as connection:
+                    connection.connect(self.address)
+        except OSError:
+            pass
+        self.listener.close()
+        for thread in self.threads:
+            thread.join()
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+
+    def accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if self.stopped.is_set():
+                    break
+                logger.warn("Rejected a planning client connection")
+                continue
+            if self.stopped.is_set():
+                connection.close()
+                break
+            threading.Thread(target=self.receive_loop, args=(connection,), daemon=True).start()
+
+    def receive_loop(self, connection):
+        """
+            Queue the requests of a client, until it disconnects.
+
+        :param connection: the client connection
+        """
+        lock = threading.Lock()
+        while not self.stopped.is_set():
+            try:
+                request_id, config, payload = connection.recv()
+            except (EOFError, OSError):
+                break
+            self.requests.put(Request(connection, lock, request_id, json.dumps(config, sort_keys=True), payload))
+        connection.close()
+
+    def batch_loop(self):
+        """
+            Gather the queued requests in batches, and dispatch them.
+        """
+        while not self.stopped.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.perf_counter() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.dispatch(batch)
+
+    def dispatch(self, batch):
+        """
+            Split a batch of requests between the workers, by configuration.
+
+        :param batch: a list of requests
+        """
+        groups = defaultdict(list)
+        for request in batch:
+            groups[request.config_key].append(request)
+        for config_key, requests in groups.items():
+            chunks = max(min(self.workers, len(requests)), 1)
+            for i in range(chunks):
+                chunk = requests[i::chunks]
+                args = (config_key, [request.payload for request in chunk])
+                if self.pool:
+                    self.pool.apply_async(plan_requests, args,
+                                          callback=partial(self.respond, chunk),
+                                          error_callback=partial(self.fail, chunk))
+                else:
+                    self.respond(chunk, plan_requests(*args))
+
+    @staticmethod
+    def respond(requests, results):
+        for request, (status, result) in zip(requests, results):
+            with request.lock:
+                try:
+                    request.connection.send((request.request_id, status, result))
+                except (OSError, EOFError):
+                    pass
+
+    def fail(self, requests, error):
+        self.respond(requests, [("error", repr(error))] * len(requests))
+
+
+class PlanningClient(object):
+    """
+        A client of a PlanningServer.
+    """
+    def __init__(self, address, authkey):
+        """
+        :param address: the address of the server
+        :param authkey: the authentication key of the server
+        """
+        self.connection = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+        self.next_request_id = 0
+
+    def plan(self, config, env, observation, seed=None):
+        """
+            Request a plan from the server.
+
+        :param config: the agent configuration, which must contain a '__class__' key
+        :param env: the environment state, which must be picklable
+        :param observation: the corresponding observation
+        :param seed: the seed of the agent, if any
+        :return: the list of actions
+        """
+        payload = pickle.dumps((env, observation, seed))
+        with self.lock:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            self.connection.send((request_id, config, payload))
+            response_id, status, result = self.connection.recv()
+        if status != "ok":
+            raise RuntimeError("The planning request {} failed: {}".format(response_id, result))
+        return result
+
+    def close(self):
+        self.connection.close()
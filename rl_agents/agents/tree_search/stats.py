@@ -0,0 +1,61 @@
+import time
+
+
+class PlannerStats(object):
+    """
+        Statistics of the cost of a planning call.
+
+        Counters and timers are only recorded when the instrumentation is enabled, and are otherwise no-ops.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.values = {}
+        """ The statistics of the current planning call"""
+
+    def reset(self):
+        self.values = {}
+
+    def add(self, key, value=1):
+        """
+            Increment a counter.
+
+        :param key: the counter name
+        :param value: the increment
+        """
+        if self.enabled:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def timer(self, key):
+        """
+            Measure the time spent in a section of code, and the number of times it was run.
+
+            The results are accumulated in the key_time and key_count statistics.
+        :param key: the section name
+        :return: a context manager
+        """
+        return Timer(self, key) if self.enabled else NULL_TIMER
+
+
+class Timer(object):
+    def __init__(self, stats, key):
+        self.stats = stats
+        self.key = key
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.stats.add(self.key + "_time", time.perf_counter() - self.start)
+        self.stats.add(self.key + "_count")
+
+
+class NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,147 @@
+import importlib
+import pickle
+import sys
+
+import numpy as np
+
+
+def observation_fingerprint(state, observation):
+    """
+        Identify a state by its observation, which assumes that the environment is fully observed.
+
+    :param state: an environment state
+    :param observation: the corresponding observation
+    :return: a hashable fingerprint
+    """
+    return np.asarray(observation).tobytes()
+
+
+def state_fingerprint(state, observation):
+    """
+        Identify a state by its snapshot if available, and by the state attribute of the environment otherwise.
+
+    :param state: an environment state
+    :param observation: the corresponding observation
+    :return: a hashable fingerprint
+    """
+    if hasattr(state, "get_state"):
+        return pickle.dumps(state.get_state())
+    return pickle.dumps(state.unwrapped.state)
+
+
+def fingerprint_factory(fingerprint):
+    """
+        Get a fingerprint function from its name.
+
+    :param fingerprint: "observation", "state", or the path "module.function" of a function mapping an environment
+                        state and its observation to a hashable fingerprint
+    :return: the fingerprint function
+    """
+    if fingerprint == "observation":
+        return observation_fingerprint
+    elif fingerprint == "state":
+        return state_fingerprint
+    elif "." in fingerprint:
+        module_name, function_name = fingerprint.rsplit(".", 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    else:
+        raise ValueError("Unknown fingerprint: {}".format(fingerprint))
+
+
+class TranspositionTable(object):
+    """
+        A table of the tree nodes, indexed by their depth and the fingerprint of their state.
+
+        It allows planners to detect that different action sequences reach the same state, so that they can share
+        or prune the corresponding subtrees. Nodes are only identified at the same depth, which keeps the tree a
+        layered DAG without cycles, in which all nodes sharing a state also share the same remaining horizon.
+    """
+    def __init__(self, fingerprint="observation"):
+        """
+        :param fingerprint: the name of the fingerprint function, see fingerprint_factory()
+        """
+        self.fingerprint = fingerprint_factory(fingerprint)
+        self.nodes = {}
+        """ Nodes indexed by their depth and state fingerprint"""
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, node, depth, state, observation):
+        """
+            Find a node that reached the same state as a given node at the same depth.
+
+            If there is none, the node is added to the table.
+
+        :param node: a node that has just been reached
+        :param depth: its depth in the tree
+        :param state: its environment state
+        :param observation: the corresponding observation
+        :return: the node of the table with the same state, or None
+        """
+        node.fingerprint = self.fingerprint(state, observation)
+        other = self.nodes.get((depth, node.fingerprint))
+        if other is None or other is node:
+            self.misses += 1
+            self.nodes[(depth, node.fingerprint)] = node
+            return None
+        self.hits += 1
+        return other
+
+    def replace(self, node, depth):
+        """
+            Make a node the representative of its state in the table.
+
+        :param node: a node whose fingerprint is known
+        :param depth: its depth in the tree
+        """
+        self.nodes[(depth, node.fingerprint)] = node
+
+    def clear(self):
+        self.nodes = {}
+
+    def reset_statistics(self):
+        self.hits = self.misses = 0
+
+    def rebuild(self, root):
+        """
+            Re-index the nodes of the subtree of a new root, after the planner tree was stepped.
+
+            Each node is also attached to one of its remaining parents, since its first parent may have been discarded.
+
+        :param root: the new root of the tree
+        """
+        self.nodes = {}
+        visited = {id(root)}
+        layer = [root]
+        depth = 0
+        while layer:
+            depth += 1
+            next_layer = []
+            for node in layer:
+                for action, child in node.children.items():
+                    if id(child) in visited:
+                        continue
+                    visited.add(id(child))
+                    child.parent = node
+                    child.action = action
+                    if child.fingerprint is not None:
+                        self.nodes.setdefault((depth, child.fingerprint), child)
+                    next_layer.append(child)
+            layer = next_layer
+
+    @property
+    def nbytes(self):
+        """
+        :return: the approximate memory used by the table and its fingerprints, in bytes
+        """
+        return sys.getsizeof(self.nodes) + sum(sys.getsizeof(key) + sys.getsizeof(key[1]) for key in self.nodes)
+
+    def statistics(self):
+        """
+        :return: the number of hits and misses of the table since the statistics were reset, its size and memory
+                 footprint
+        """
+        return dict(transposition_hits=self.hits,
+                    transposition_misses=self.misses,
+                    transposition_size=len(self.nodes),
+                    transposition_bytes=self.nbytes)
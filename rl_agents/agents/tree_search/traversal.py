@@ -0,0 +1,64 @@
+from collections import deque
+
+
+def breadth_first(root, max_depth=None, prune=None, paths=False, unique=False):
+    """
+        Lazily traverse a tree in breadth-first order, starting from its root.
+
+    :param root: the root node, which is yielded first with depth 0
+    :param max_depth: the maximum depth of the traversed nodes, relative to the root, if limited
+    :param prune: a predicate of the nodes whose children must not be traversed, if any
+    :param paths: whether each node is yielded with the tuple of actions leading to it from the root, instead of
+                  its depth
+    :param unique: whether nodes shared by several parents through a transposition table are only traversed once
+    :return: a generator of (node, depth), or (node, path) tuples
+    """
+    queue = deque([(root, () if paths else 0)])
+    visited = {id(root)} if unique else None
+    while queue:
+        node, key = queue.popleft()
+        yield node, key
+        if not node.children \
+                or (max_depth is not None and (len(key) if paths else key) >= max_depth) \
+                or (prune is not None and prune(node)):
+            continue
+        for action, child in node.children.items():
+            if unique:
+                if id(child) in visited:
+                    continue
+                visited.add(id(child))
+            queue.append((child, key + (action,) if paths else key + 1))
+
+
+def depth_first(root, max_depth=None, prune=None, paths=False, unique=False):
+    """
+        Lazily traverse a tree in depth-first pre-order, starting from its root.
+
+        The children of a node are traversed in the order of its children dict, without recursion so that deep
+        trees do not reach the interpreter recursion limit.
+
+    :param root: the root node, which is yielded first with depth 0
+    :param max_depth: the maximum depth of the traversed nodes, relative to the root, if limited
+    :param prune: a predicate of the nodes whose children must not be traversed, if any
+    :param paths: whether each node is yielded with the tuple of actions leading to it from the root, instead of
+                  its depth
+    :param unique: whether nodes shared by several parents through a transposition table are only traversed once
+    :return: a generator of (node, depth), or (node, path) tuples
+    """
+    stack = [(root, () if paths else 0)]
+    visited = {id(root)} if unique else None
+    while stack:
+        node, key = stack.pop()
+        yield node, key
+        if not node.children \
+                or (max_depth is not None and (len(key) if paths else key) >= max_depth) \
+                or (prune is not None and prune(node)):
+            continue
+        children = []
+        for action, child in node.children.items():
+            if unique:
+                if id(child) in visited:
+                    continue
+                visited.add(id(child))
+            children.append((child, key + (action,) if paths else key + 1))
+        stack.extend(reversed(children))
@@ -2,7 +2,9 @@ import json
 import os
 
 from gym import logger
+from gym.utils.json_utils import json_encode_np
 
+from rl_agents.agents.tree_search.export import TreeExporter
 from rl_agents.configuration import serialize
 from rl_agents.trainer.graphics import RewardViewer
 from rl_agents.agents.graphics import AgentGraphics
@@ -17,6 +19,8 @@ class Evaluation(object):
     OUTPUT_FOLDER = 'out'
     SAVED_MODELS_FOLDER = 'saved_models'
     METADATA_FILE = 'metadata.{}.json'
+    PLANNER_STATS_FILE = 'planner_stats.{}.jsonl'
+    TREES_FILE = 'trees.{}.episode_{:06}.npz'
 
     def __init__(self,
                  env,
@@ -29,7 +33,8 @@ class Evaluation(object):
                  display_env=True,
                  display_agent=True,
                  display_rewards=True,
-                 close_env=True):
+                 close_env=True,
+                 export_trees=False):
         """
 
         :param env: The environment to be solved, possibly wrapping an AbstractEnv environment
@@ -45,6 +50,7 @@ class Evaluation(object):
         :param display_agent: Add the agent graphics to the environment viewer, if supported
         :param display_rewards: Display the performances of the agent through the episodes
         :param close_env: Should the environment be closed when the evaluation is closed
+        :param export_trees: Write the tree of the agent planner after each decision, in one file per episode
 
         """
         self.env = env
@@ -61,6 +67,23 @@ class Evaluation(object):
                                  video_callable=(None if display_env else False))
         self.write_metadata()
 
+        self.planner_stats = []
+        """ The statistics of the planning calls of the current episode"""
+        try:
+            # Collect the statistics of each planning call, if the planner is instrumented
+            if self.agent.planner.stats.enabled:
+                self.agent.planner.plan_hooks.append(self.record_planner_stats)
+        except AttributeError:
+            pass
+
+        self.tree_exporter = None
+        if export_trees:
+            try:
+                self.agent.planner.plan_hooks.append(self.record_tree)
+                self.tree_exporter = TreeExporter()
+            except AttributeError:
+                logger.warn("The {} agent has no planner tree to export".format(self.agent.__class__.__name__))
+
         if recover:
             self.load_agent_model(recover)
 
@@ -180,6 +203,12 @@ class Evaluation(object):
         if self.reward_viewer:
             self.reward_viewer.update(total_reward)
         logger.info("Episode {} score: {}".format(episode, total_reward))
+        if self.planner_stats:
+            self.write_planner_stats()
+        if self.tree_exporter:
+            file_infix = '{}.{}'.format(self.monitor.monitor_id, os.getpid())
+            self.tree_exporter.end_episode(os.path.join(self.monitor.directory,
+                                                        self.TREES_FILE.format(file_infix, episode)))
 
     def after_some_episodes(self, episode):
         if self.monitor.is_episode_selected():
@@ -198,6 +227,24 @@ class Evaluation(object):
         with open(file, 'w') as f:
             json.dump(metadata, f, sort_keys=True, indent=4)
 
+    def record_planner_stats(self, planner, stats):
+        self.planner_stats.append(dict(stats, episode=self.monitor.episode_id))
+
+    def write_planner_stats(self):
+        """
+            Append the statistics of the planning calls of the episode alongside the monitor stats file, one JSON
+            object per line.
+        """
+        file_infix = '{}.{}'.format(self.monitor.monitor_id, os.getpid())
+        file = os.path.join(self.monitor.directory, self.PLANNER_STATS_FILE.format(file_infix))
+        with open(file, 'a') as f:
+            for stats in self.planner_stats:
+                f.write(json.dumps(stats, default=json_encode_np) + "\n")
+        self.planner_stats = []
+
+    def record_tree(self, planner, stats):
+        self.tree_exporter.record(planner)
+
     def seed(self):
         seed = self.monitor.seed(self.sim_seed)
         self.agent.seed(seed[0])  # Seed the agent with the main environment seed
@@ -213,6 +260,13 @@ class Evaluation(object):
         """
         if self.training:
             self.save_agent_model(self.monitor.episode_id)
+        try:
+            # Stop the worker processes of the agent, if any
+            self.agent.close()
+        except AttributeError:
+            pass
         self.monitor.close()
+        if self.tree_exporter:
+            self.tree_exporter.close()
         if self.close_env:
             self.env.close()
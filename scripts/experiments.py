@@ -6,6 +6,7 @@ Usage:
                                              [--no-display]
                                              [--seed <str>]
                                              [--analyze]
+                                             [--export-trees]
   experiments benchmark <benchmark> (--train|--test)
                                     [--episodes <count>]
                                     [--name-from-config]
@@ -13,12 +14,14 @@ Usage:
                                     [--seed <str>]
                                     [--analyze]
                                     [--processes <count>]
+                                    [--export-trees]
   experiments -h | --help
 
 Options:
   -h --help            Show this screen.
   --analyze            Automatically analyze the experiment results.
   --episodes <count>   Number of episodes [default: 5].
+  --export-trees       Write the planner trees of tree search agents after each decision.
   --no-display         Disable environment, agent, and rewards rendering.
   --name-from-config   Name the output folder from the corresponding config files
   --processes <count>  Number of running processes [default: 4].
@@ -75,7 +78,8 @@ def evaluate(environment_config, agent_config, options):
                             sim_seed=options['--seed'],
                             display_env=not options['--no-display'],
                             display_agent=not options['--no-display'],
-                            display_rewards=not options['--no-display'])
+                            display_rewards=not options['--no-display'],
+                            export_trees=options['--export-trees'])
     if options['--train']:
         evaluation.train()
     elif options['--test']:
@@ -0,0 +1,78 @@
+"""
+Usage:
+  planning_server_benchmark <environment> <agent> [options]
+  planning_server_benchmark -h | --help
+
+Send concurrent planning requests to a local planning server, and report its throughput and latencies.
+
+Options:
+  -h --help                 Show this screen.
+  --clients <count>         Number of concurrent clients [default: 8].
+  --requests <count>        Number of requests sent by each client [default: 20].
+  --workers <count>         Number of worker processes of the server [default: 4].
+  --batch-size <count>      Maximum number of requests in a batch [default: 16].
+  --address <address>       Address host:port or Unix socket path of a running server. If not set, a server is started.
+  --authkey <key>           Hexadecimal authentication key of the running server.
+"""
+import json
+import threading
+import time
+
+import numpy as np
+from docopt import docopt
+
+from rl_agents.agents.common import load_environment
+from rl_agents.agents.tree_search.server import PlanningServer, PlanningClient
+
+
+def parse_address(address):
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address
+
+
+def main():
+    opts = docopt(__doc__)
+    env = load_environment(opts["<environment>"]).unwrapped
+    with open(opts["<agent>"]) as f:
+        agent_config = json.loads(f.read())
+    server = None
+    if opts["--address"]:
+        address = parse_address(opts["--address"])
+        authkey = bytes.fromhex(opts["--authkey"] or "")
+    else:
+        server = PlanningServer(workers=int(opts["--workers"]), batch_size=int(opts["--batch-size"])).start()
+        address, authkey = server.address, server.authkey
+
+    observation = env.reset()
+    latencies = []
+
+    def client_loop():
+        client = PlanningClient(address, authkey)
+        for _ in range(int(opts["--requests"])):
+            start = time.perf_counter()
+            client.plan(agent_config, env, observation)
+            latencies.append(time.perf_counter() - start)
+        client.close()
+
+    # Warm the agents of the server up
+    PlanningClient(address, authkey).plan(agent_config, env, observation)
+    threads = [threading.Thread(target=client_loop) for _ in range(int(opts["--clients"]))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print("{} requests in {:.2f} s: {:.1f} plans/s".format(len(latencies), elapsed, len(latencies) / elapsed))
+    print("latency p50: {:.1f} ms, p99: {:.1f} ms".format(1000 * np.percentile(latencies, 50),
+                                                           1000 * np.percentile(latencies, 99)))
+    if server:
+        print("mean batch size: {:.1f}".format(server.stats["requests"] / max(server.stats["batches"], 1)))
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
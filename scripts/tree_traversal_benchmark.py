@@ -0,0 +1,87 @@
+"""
+Usage:
+  tree_traversal_benchmark [options]
+  tree_traversal_benchmark -h | --help
+
+Compare the tree traversals on a full tree, in terms of nodes traversed per second.
+
+Options:
+  -h --help                 Show this screen.
+  --branching <count>       Branching factor of the tree [default: 10].
+  --depth <count>           Depth of the tree, 10^5 nodes by default [default: 5].
+  --repeat <count>          Number of runs of each traversal, the best of which is reported [default: 3].
+"""
+import time
+
+import numpy as np
+from docopt import docopt
+
+from rl_agents.agents.tree_search.abstract import Node
+from rl_agents.agents.tree_search.mcts import MCTS, MCTSAgent
+from rl_agents.agents.tree_search.traversal import breadth_first, depth_first
+
+
+def legacy_breadth_first_search(root, operator=None, condition=None):
+    """
+        The former implementation of Node.breadth_first_search, with a list as queue.
+    """
+    queue = [(root, [])]
+    while queue:
+        (node, path) = queue.pop(0)
+        for next_key, next_node in node.children.items():
+            if (condition is None) or condition(next_node):
+                returned = operator(next_node, path + [next_key]) if operator else (next_node, path + [next_key])
+                yield returned
+            if (condition is None) or not condition(next_node):
+                queue.append((next_node, path + [next_key]))
+
+
+def build_tree(branching, depth):
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy)
+    actions = (np.arange(branching), np.ones(branching) / branching)
+    leaves = [planner.root]
+    for _ in range(depth):
+        next_leaves = []
+        for leaf in leaves:
+            leaf.expand(actions)
+            next_leaves.extend(leaf.children.values())
+        leaves = next_leaves
+    return planner.root
+
+
+def measure(traversal, repeat):
+    """
+        Measure the throughput of a traversal.
+
+    :param traversal: a function of the tree returning an iterator of nodes
+    :param repeat: the number of runs
+    :return: the number of nodes traversed, and the best number of nodes traversed per second
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nodes = sum(1 for _ in traversal())
+        best = min(best, time.perf_counter() - start)
+    return nodes, nodes / best
+
+
+def main():
+    opts = docopt(__doc__)
+    depth = int(opts["--depth"])
+    root = build_tree(int(opts["--branching"]), depth)
+    traversals = [
+        ("legacy bfs, paths", lambda: legacy_breadth_first_search(root)),
+        ("Node.breadth_first_search", lambda: Node.breadth_first_search(root)),
+        ("breadth_first, paths", lambda: breadth_first(root, paths=True)),
+        ("breadth_first", lambda: breadth_first(root)),
+        ("depth_first", lambda: depth_first(root)),
+        ("depth_first, unique", lambda: depth_first(root, unique=True)),
+        ("depth_first, depth < {}".format(depth), lambda: depth_first(root, max_depth=depth - 1)),
+    ]
+    for name, traversal in traversals:
+        nodes, throughput = measure(traversal, int(opts["--repeat"]))
+        print("{:<28} {:>8} nodes {:>12.0f} nodes/s".format(name, nodes, throughput))
+
+
+if __name__ == "__main__":
+    main()
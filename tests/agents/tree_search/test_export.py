@@ -0,0 +1,52 @@
+import gym
+import numpy as np
+
+from rl_agents.agents.tree_search.deterministic import DeterministicPlannerAgent
+from rl_agents.agents.tree_search.export import TreeExporter, load_trees, build_tree
+from rl_agents.agents.tree_search.mcts import MCTSAgent
+
+
+def test_export_and_load(tmpdir):
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    observation = env.reset()
+    agent = MCTSAgent(env, config=dict(budget=100, max_depth=5, step_strategy="subtree"))
+    exporter = TreeExporter()
+    sizes, root_children = [], []
+    for _ in range(3):
+        action = agent.act(observation)
+        exporter.record(agent.planner)
+        sizes.append(agent.planner.tree_size_and_depth()[0])
+        root_children.append({a: (child.count, child.value) for a, child in agent.planner.root.children.items()})
+        observation, _, _, _ = env.step(action)
+    path = tmpdir.join("trees.npz").strpath
+    exporter.end_episode(path)
+    exporter.close()
+
+    trees = load_trees(path)
+    assert [step for step, _ in trees] == [0, 1, 2]
+    for (_, tree), size, children in zip(trees, sizes, root_children):
+        assert tree["parent"].size == size
+        assert np.all(tree["parent"][1:] < np.arange(1, size))
+        assert np.all(np.isnan(tree["upper_bound"]))
+        root = build_tree(tree)
+        assert {a: (child.count, child.value) for a, child in root.children.items()} == children
+
+
+def test_export_deterministic_bounds(tmpdir):
+    env = gym.make('CartPole-v0')
+    observation = env.reset()
+    agent = DeterministicPlannerAgent(env, config=dict(budget=20, gamma=0.9))
+    agent.act(observation)
+    exporter = TreeExporter(compress=True)
+    exporter.record(agent.planner, step=7)
+    path = tmpdir.join("trees.npz").strpath
+    exporter.end_episode(path)
+    exporter.close()
+
+    (step, tree), = load_trees(path)
+    assert step == 7
+    root = build_tree(tree)
+    assert root.get_value_upper_bound() == agent.planner.root.get_value_upper_bound()
+    assert np.all(np.isnan(tree["prior"]))
+    assert root.selection_rule() in agent.planner.root.children
@@ -1,5 +1,9 @@
 import gym
-from rl_agents.agents.tree_search.mcts import MCTSAgent
+import numpy as np
+from gym.envs.classic_control import CartPoleEnv
+
+from rl_agents.agents.tree_search.mcts import MCTSAgent, MCTS
+from rl_agents.agents.tree_search.traversal import depth_first
 
 
 def test_cartpole():
@@ -17,3 +21,359 @@ def test_cartpole():
         steps += 1
 
     assert steps == env._max_episode_steps
+
+
+def test_children_statistics():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    agent = MCTSAgent(env, config=dict(budget=200, max_depth=5))
+    agent.plan(None)
+
+    nodes = [agent.planner.root]
+    for node in nodes:
+        nodes.extend(node.children.values())
+        for action, child in node.children.items():
+            assert node.child_actions[child.slot] == action
+            assert node.child_counts[child.slot] == child.count
+            assert node.child_values[child.slot] == child.value
+            assert node.child_priors[child.slot] == child.prior
+            assert list(child.path()) == list(node.path()) + [action]
+        if node.children:
+            counts = np.nonzero(node.child_counts == np.amax(node.child_counts))[0]
+            assert node.best_slot == counts[np.argmax(node.child_values[counts])]
+
+
+def test_tree_parallel_single_worker_matches_sequential():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    env.reset()
+    planners = [MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                     dict(budget=300, max_depth=6, tree_workers=workers)) for workers in [0, 1]]
+    for planner in planners:
+        planner.seed(0)
+    plans = [planner.plan(env, None) for planner in planners]
+    assert plans[0] == plans[1]
+    sequential, parallel = planners[0].root, planners[1].root
+    assert np.array_equal(sequential.child_counts, parallel.child_counts)
+    assert np.array_equal(sequential.child_values, parallel.child_values)
+
+
+def test_tree_parallel():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy, dict(budget=300, max_depth=6, tree_workers=4))
+    assert planner.plan(env, None)
+    assert planner.root.count == planner.config["iterations"]
+    for child in planner.root.children.values():
+        assert child.virtual_loss == 0
+        assert planner.root.child_counts[child.slot] == child.count
+
+
+def test_root_parallel():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    agent = MCTSAgent(env, config=dict(budget=200, max_depth=5, root_workers=2))
+    agent.seed(0)
+    try:
+        for _ in range(2):
+            action = agent.act(None)
+            assert action in agent.planner.root.children
+            env.step(action)
+        assert len(agent.planner.worker_stats) == 2
+        assert all(stats["iterations"] == agent.planner.config["iterations"] for stats in agent.planner.worker_stats)
+        assert agent.planner.root.count == 2 * agent.planner.config["iterations"] - 2
+    finally:
+        agent.planner.close()
+
+
+class SnapshotCartPoleEnv(CartPoleEnv):
+    def get_state(self):
+        return np.array(self.state), self.steps_beyond_done
+
+    def set_state(self, snapshot):
+        state, self.steps_beyond_done = snapshot
+        self.state = np.array(state)
+
+
+def test_snapshot_copies():
+    envs = [CartPoleEnv(), SnapshotCartPoleEnv()]
+    plans = []
+    for env in envs:
+        env.seed(0)
+        env.reset()
+        planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy, dict(budget=200, max_depth=5))
+        planner.seed(0)
+        plans.append(planner.plan(env, None))
+    assert plans[0] == plans[1]
+    assert planner.env_copier.stats["snapshot"]["count"] == planner.config["iterations"]
+    assert planner.env_copier.stats["deepcopy"]["count"] == 1
+
+
+def test_wrapped_snapshot_copies():
+    from gym.wrappers import TimeLimit
+    env = TimeLimit(SnapshotCartPoleEnv(), max_episode_steps=200)
+    env.seed(0)
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy, dict(budget=200, max_depth=5))
+    planner.plan(env, None)
+    # The state of the wrapper is not in the snapshots of the wrapped env, which must be deep copied
+    assert "snapshot" not in planner.env_copier.stats
+    copy = planner.env_copier.restore(env)
+    assert isinstance(copy, TimeLimit) and copy is not env
+    assert copy._elapsed_steps == env._elapsed_steps == 0
+
+
+def test_clone_pool():
+    env = SnapshotCartPoleEnv()
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=200, max_depth=5, clone_pool_size=4))
+    planner.plan(env, None)
+    assert planner.env_copier.stats["deepcopy"]["count"] == 1
+    assert planner.env_copier.stats["pool"]["count"] == planner.config["iterations"] - 1
+    assert len(planner.clone_pool.free) == 1
+
+
+def test_time_budget():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=10**6, max_depth=5, time_budget=0.1))
+    assert planner.plan(env, None)
+    assert 0 < planner.iterations_used < planner.config["iterations"]
+    assert planner.root.count == planner.iterations_used
+
+
+def test_pondering():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    agent = MCTSAgent(env, config=dict(budget=100, max_depth=5, step_strategy="subtree",
+                                       ponder=True, ponder_budget=50))
+    action = agent.act(None)
+    agent.ponder_thread.join()
+    assert agent.ponder_iterations == 50
+    subtree = agent.planner.root.children[action]
+    assert subtree.count >= 50
+    env.step(action)
+    agent.act(None)
+    assert agent.planner.root is subtree
+
+
+def test_read_tree_while_pondering():
+    env = gym.make('CartPole-v0')
+    env.reset()
+    agent = MCTSAgent(env, config=dict(budget=100, max_depth=5, step_strategy="subtree", max_nodes=50,
+                                       ponder=True, ponder_budget=500))
+    agent.act(None)
+    while agent.ponder_thread.is_alive():
+        with agent.planner.tree_lock:
+            assert all(node.parent.children[node.action] is node for node, depth in depth_first(agent.planner.root)
+                       if depth > 0)
+            assert agent.planner.get_plan()
+    agent.close()
+
+
+def test_receding_horizon():
+    env = CartPoleEnv()
+    env.seed(0)
+    observation = env.reset()
+    agent = MCTSAgent(env, config=dict(budget=200, max_depth=5, step_strategy="subtree", receding_horizon=3))
+    plans = []
+    agent.planner.plan_hooks.append(lambda planner, stats: plans.append(planner.get_plan()))
+    actions = []
+    for _ in range(6):
+        actions.append(agent.act(observation))
+        observation, _, _, _ = env.step(actions[-1])
+    assert len(plans) == 2
+    assert actions == plans[0][:3] + plans[1][:3]
+
+    # Only commit to the first action when the plan is not confident enough
+    agent = MCTSAgent(env, config=dict(budget=200, max_depth=5, receding_horizon=3, receding_horizon_confidence=1))
+    plans = []
+    agent.planner.plan_hooks.append(lambda planner, stats: plans.append(planner.get_plan()))
+    for _ in range(3):
+        observation, _, _, _ = env.step(agent.act(observation))
+    assert len(plans) == 3
+
+
+def test_plan_batch():
+    envs = [CartPoleEnv() for _ in range(4)]
+    observations = []
+    for i, env in enumerate(envs):
+        env.seed(i)
+        observations.append(env.reset())
+    plans = []
+    for batch_workers in [0, 2]:
+        agent = MCTSAgent(envs[0], config=dict(budget=100, max_depth=5, batch_workers=batch_workers))
+        agent.seed(0)
+        plans.append(agent.plan_batch(envs, observations))
+        agent.close()
+        assert agent.batch_stats["roots"] == 4
+        assert agent.batch_stats["roots_per_second"] > 0
+    assert plans[0] == plans[1]
+    assert all(plan for plan in plans[0])
+
+    # The batch workers neither start worker processes nor ponder
+    agent = MCTSAgent(envs[0], config=dict(budget=100, max_depth=5, batch_workers=2, root_workers=2,
+                                           rollout_workers=2, ponder=True, step_strategy="subtree"))
+    try:
+        assert all(plan for plan in agent.plan_batch(envs, observations))
+    finally:
+        agent.close()
+
+
+def test_max_nodes():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=1000, max_depth=5, step_strategy="subtree", max_nodes=60))
+    for _ in range(3):
+        action = planner.plan(env, None)[0]
+        assert planner.tree_size_and_depth()[0] == planner.node_count <= 60
+        planner.step(action)
+    assert planner.evicted_nodes > 0
+    nodes = [planner.root]
+    for node in nodes:
+        nodes.extend(node.children.values())
+        for child in node.children.values():
+            assert node.child_counts[child.slot] == child.count
+
+
+def test_batched_rollouts():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    env.reset()
+    for workers in [0, 2]:
+        planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                       dict(budget=200, max_depth=5, rollout_leaves=4, rollouts_per_leaf=3, rollout_workers=workers))
+        assert planner.plan(env, None)
+        assert planner.root.count == planner.iterations_used == 40
+        nodes = [planner.root]
+        for node in nodes:
+            nodes.extend(node.children.values())
+            assert node.virtual_loss == 0
+            for child in node.children.values():
+                assert node.child_counts[child.slot] == child.count
+        # Leaves at the maximum depth are not evaluated
+        assert 0 < planner.rollouts.stats["rollouts"] <= 3 * 40
+        assert planner.rollouts.stats["rollouts"] % 3 == 0
+        assert planner.rollouts.stats["steps_per_second"] > 0
+        planner.close()
+
+
+class BanditEnv(gym.Env):
+    """
+        A two-armed bandit, whose first arm always gives the maximum reward.
+    """
+    action_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        return 0, float(action == 0), False, {}
+
+
+def test_value_function():
+    # The bandit never terminates, and the tree cannot reach the maximum depth in the 5 iterations: every descent ends
+    # at a leaf evaluated by a truncated rollout
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=100, max_depth=20, rollout_depth=1, instrumentation=True),
+                   value_function=lambda observations: np.full(len(observations), 100.))
+    planner.start_stats()
+    assert planner.plan(BanditEnv(), None)
+    planner.end_stats()
+    assert planner.rollouts.stats["rollouts"] == planner.iterations_used == 5
+    assert planner.stats.values["simulator_steps_saved"] == planner.steps_saved > 0
+    # Each return is bootstrapped with the value function, and the rewards are non-negative
+    root = planner.root
+    assert np.all(root.child_values[root.child_counts > 0] >= 100)
+
+
+def test_early_stopping():
+    for rule in ["visits", "confidence"]:
+        for workers in [0, 2]:
+            planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                           dict(budget=2000, max_depth=1, tree_workers=workers, early_stopping=rule))
+            planner.seed(0)
+            assert planner.plan(BanditEnv(), None)[0] == 0
+            assert planner.iterations_used < planner.config["iterations"]
+
+
+def test_progressive_widening():
+    env = BanditEnv()
+    env.action_space = gym.spaces.Discrete(50)
+    # The most probable actions are the last ones
+    prior_policy = lambda state, observation: (np.arange(50), np.arange(1, 51) / np.sum(np.arange(1, 51)))
+    planner = MCTS(prior_policy, MCTSAgent.random_policy,
+                   dict(budget=100, max_depth=1, widening_coefficient=1, widening_exponent=0.5))
+    planner.plan(env, None)
+    root = planner.root
+    assert len(root.children) == np.ceil(np.sqrt(root.count - 1))
+    assert sorted(root.children) == list(range(50 - len(root.children), 50))
+    assert len(root.pending_actions) == 50 - len(root.children)
+
+
+def test_progressive_widening_with_early_stopping():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    observation = env.reset()
+    for rule in ["visits", "confidence"]:
+        # The root has a single child and pending actions during the first iterations
+        agent = MCTSAgent(env, config=dict(budget=500, max_depth=5, widening_coefficient=0.2, early_stopping=rule,
+                                           early_stopping_period=1))
+        agent.seed(0)
+        assert agent.plan(observation)
+        assert len(agent.planner.root.children) > 1
+
+
+def test_lazy_prior_conversion():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    env.reset()
+    planners = [MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                     dict(budget=300, max_depth=6, step_strategy="prior")) for _ in range(2)]
+    lazy, eager = planners
+    for planner in planners:
+        planner.seed(0)
+    for _ in range(3):
+        plans = [planner.plan(env, None) for planner in planners]
+        assert plans[0] == plans[1]
+        assert np.array_equal(lazy.root.child_counts, eager.root.child_counts)
+        assert np.array_equal(lazy.root.child_priors, eager.root.child_priors)
+        env.step(plans[0][0])
+        lazy.step(plans[0][0])
+        assert lazy.root.epoch < lazy.prior_epoch
+        eager.step_by_subtree(plans[0][0])
+        eager.root.convert_visits_to_prior_in_branch()
+
+
+def test_batch_policies():
+    env = gym.make('CartPole-v0')
+    env.seed(0)
+    env.reset()
+    batches = []
+
+    def batch_policy(states, observations):
+        batches.append(len(states))
+        return [MCTSAgent.random_policy(state, observation) for state, observation in zip(states, observations)]
+
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=200, max_depth=5, rollout_leaves=8, instrumentation=True))
+    planner.batch_prior_policy = planner.batch_rollout_policy = batch_policy
+    planner.start_stats()
+    assert planner.plan(env, None)
+    planner.end_stats()
+    assert planner.root.count == planner.iterations_used == 40
+    # One batch of priors and at most max_depth batches of rollout actions per wave
+    assert len(batches) <= 5 * (1 + 5)
+    assert max(batches) > 1
+    stats = planner.stats.values
+    assert stats["inference_count"] == len(batches)
+    assert stats["inference_observations"] == sum(batches)
+    assert stats["inference_observations_per_second"] > 0
+    nodes = [planner.root]
+    for node in nodes:
+        nodes.extend(node.children.values())
+        assert node.virtual_loss == 0
+        for child in node.children.values():
+            assert node.child_counts[child.slot] == child.count
+    planner.close()
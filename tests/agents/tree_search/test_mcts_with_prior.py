@@ -0,0 +1,50 @@
+import pytest
+from gym.envs.classic_control import CartPoleEnv
+
+torch = pytest.importorskip("torch")
+
+
+def test_plan_batch():
+    from rl_agents.agents.tree_search.mcts_with_prior import MCTSWithPriorPolicyAgent
+
+    envs = [CartPoleEnv() for _ in range(4)]
+    observations = []
+    for i, env in enumerate(envs):
+        env.seed(i)
+        observations.append(env.reset())
+    torch.manual_seed(0)
+    prior_state = None
+    plans = []
+    for batch_workers in [0, 2]:
+        agent = MCTSWithPriorPolicyAgent(envs[0], config=dict(budget=50, max_depth=5, batch_workers=batch_workers))
+        # The same trained prior for both agents
+        if prior_state is None:
+            prior_state = agent.prior_agent.policy_net.state_dict()
+        agent.prior_agent.policy_net.load_state_dict(prior_state)
+        agent.seed(0)
+        plans.append(agent.plan_batch(envs, observations))
+        if not batch_workers:
+            # The copy planning the batch uses the trained prior, rather than a new one
+            for name, parameter in agent.batch_agent.prior_agent.policy_net.state_dict().items():
+                assert torch.equal(parameter, prior_state[name])
+        agent.close()
+    assert plans[0] == plans[1]
+
+
+def test_rollout_workers():
+    from rl_agents.agents.tree_search.mcts_with_prior import MCTSWithPriorPolicyAgent
+
+    # The prior agent cannot be pickled to the rollout workers
+    with pytest.raises(ValueError):
+        MCTSWithPriorPolicyAgent(CartPoleEnv(), config=dict(budget=200, max_depth=5, rollout_workers=2))
+
+
+def test_default_config():
+    from rl_agents.agents.tree_search.mcts_with_prior import MCTSWithPriorPolicyAgent
+
+    # Planning in waves with batched evaluations of the prior agent is opt-in
+    agent = MCTSWithPriorPolicyAgent(CartPoleEnv(), config=dict(budget=50, max_depth=5))
+    assert agent.planner.config["rollout_leaves"] == 1
+    agent = MCTSWithPriorPolicyAgent(CartPoleEnv(), config=dict(budget=50, max_depth=5, rollout_leaves=8))
+    agent.planner.seed(0)
+    assert agent.plan(agent.env.reset())
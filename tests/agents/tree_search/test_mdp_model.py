@@ -0,0 +1,92 @@
+import gym
+import numpy as np
+from gym import spaces
+
+from rl_agents.agents.tree_search.deterministic import DeterministicPlannerAgent
+from rl_agents.agents.tree_search.mcts import MCTSAgent
+from rl_agents.agents.tree_search.mdp_model import FiniteMDPModel
+
+
+class MDP(object):
+    def __init__(self, transition, reward, mode="deterministic"):
+        self.transition = np.array(transition)
+        self.reward = np.array(reward, dtype=float)
+        self.terminal = np.zeros(self.reward.shape[0], dtype=bool)
+        self.mode = mode
+        self.state = 0
+
+
+class ChainEnv(gym.Env):
+    """
+        An environment that can be converted to a finite MDP: a chain whose last state is rewarded.
+    """
+    def __init__(self, size=4):
+        transition = [[max(s - 1, 0), min(s + 1, size - 1)] for s in range(size)]
+        reward = [[0, 1 if s >= size - 2 else 0] for s in range(size)]
+        self.mdp = MDP(transition, reward)
+        self.action_space = spaces.Discrete(2)
+
+    def reset(self):
+        self.mdp.state = 0
+        return self.mdp.state
+
+    def step(self, action):
+        reward = self.mdp.reward[self.mdp.state, action]
+        self.mdp.state = int(self.mdp.transition[self.mdp.state, action])
+        return self.mdp.state, reward, False, {}
+
+    def to_finite_mdp(self):
+        return self.mdp
+
+
+def test_finite_mdp_planning():
+    plans = []
+    for finite_mdp in [False, True]:
+        env = ChainEnv()
+        observation = env.reset()
+        agent = DeterministicPlannerAgent(env, config=dict(budget=50, gamma=0.9, finite_mdp=finite_mdp))
+        agent.seed(0)
+        plans.append(agent.plan(observation))
+        if finite_mdp:
+            assert "deepcopy" not in agent.planner.env_copier.stats
+            assert isinstance(agent.planner.root.state, FiniteMDPModel)
+    assert plans[0] == plans[1]
+    assert plans[1][0] == 1
+
+    env = ChainEnv()
+    observation = env.reset()
+    agent = MCTSAgent(env, config=dict(budget=200, max_depth=8, finite_mdp=True))
+    agent.seed(0)
+    assert agent.plan(observation)[0] == 1
+    assert "deepcopy" not in agent.planner.env_copier.stats
+
+
+def test_stochastic_transitions():
+    transition = np.zeros((2, 1, 2))
+    transition[:, 0] = [0.25, 0.75]
+    model = FiniteMDPModel(MDP(transition, [[0], [1]], mode="stochastic"), np_random=np.random.RandomState(0))
+    states = []
+    for _ in range(2000):
+        model.set_state(0)
+        states.append(model.step(0)[0])
+    assert np.isclose(np.mean(states), 0.75, atol=0.03)
+
+
+def test_stochastic_seeding():
+    transition = np.zeros((3, 2, 3))
+    transition[:, 0] = [0.5, 0.25, 0.25]
+    transition[:, 1] = [0.1, 0.3, 0.6]
+    env = ChainEnv(size=3)
+    env.mdp = MDP(transition, [[0, 0], [1, 0], [0, 1]], mode="stochastic")
+    agent = MCTSAgent(env, config=dict(budget=100, max_depth=4, finite_mdp=True))
+    agent.seed(0)
+    agent.plan(env.reset())
+    # The scratch copies of the model kept from planning must follow the reseeding of the planner
+    agent.reset()
+    agent.seed(1)
+    agent.plan(env.reset())
+    fresh_agent = MCTSAgent(env, config=dict(budget=100, max_depth=4, finite_mdp=True))
+    fresh_agent.seed(1)
+    fresh_agent.plan(env.reset())
+    assert np.array_equal(agent.planner.root.child_counts, fresh_agent.planner.root.child_counts)
+    assert np.array_equal(agent.planner.root.child_values, fresh_agent.planner.root.child_values)
@@ -0,0 +1,78 @@
+import threading
+
+import gym
+from gym.envs.classic_control import CartPoleEnv
+
+from rl_agents.agents.tree_search.deterministic import DeterministicPlannerAgent
+from rl_agents.agents.tree_search.mcts import MCTSAgent
+
+
+def run_episode(agent, steps=5):
+    env = agent.env
+    env.seed(0)
+    observation = env.reset()
+    agent.reset()
+    actions = []
+    for _ in range(steps):
+        actions.append(agent.act(observation))
+        observation, _, _, _ = env.step(actions[-1])
+    return actions
+
+
+def test_plan_cache():
+    agent = MCTSAgent(gym.make('CartPole-v0'), config=dict(budget=100, max_depth=5, plan_cache_size=10))
+    agent.seed(0)
+    first = run_episode(agent)
+    assert agent.plan_cache.misses == 5 and agent.plan_cache.hits == 0
+    second = run_episode(agent)
+    assert first == second
+    assert agent.plan_cache.hits == 5
+
+
+def test_plan_cache_eviction_and_persistence(tmpdir):
+    path = tmpdir.join("plans.pkl").strpath
+    env = gym.make('CartPole-v0')
+    agent = MCTSAgent(env, config=dict(budget=50, max_depth=5, plan_cache_size=3, plan_cache_path=path))
+    run_episode(agent)
+    assert len(agent.plan_cache.entries) == 3
+    agent.reset()
+
+    other_agent = MCTSAgent(env, config=dict(budget=50, max_depth=5, plan_cache_size=3, plan_cache_path=path))
+    assert list(other_agent.plan_cache.entries) == list(agent.plan_cache.entries)
+    # A different planner configuration does not reuse the plans
+    different_agent = MCTSAgent(env, config=dict(budget=60, max_depth=5, plan_cache_size=3, plan_cache_path=path))
+    run_episode(different_agent)
+    assert different_agent.plan_cache.hits == 0
+
+
+def test_plan_cache_subtrees():
+    env = gym.make('CartPole-v0')
+    agent = MCTSAgent(env, config=dict(budget=100, max_depth=5, step_strategy="subtree",
+                                       plan_cache_size=10, plan_cache_subtrees=True))
+    env.seed(0)
+    observation = env.reset()
+    agent.act(observation)
+    children = {a: (child.count, child.value) for a, child in agent.planner.root.children.items()}
+
+    agent.reset()
+    agent.act(observation)
+    assert agent.plan_cache.hits == 1
+    assert {a: (child.count, child.value) for a, child in agent.planner.root.children.items()} == children
+    assert all(child.planner is agent.planner for child in agent.planner.root.children.values())
+
+
+def test_plan_cache_subtrees_with_states():
+    env = CartPoleEnv()
+    env.seed(0)
+    observation = env.reset()
+    # A viewer that cannot be deep copied, such as a rendering window
+    env.viewer = threading.Lock()
+    agent = DeterministicPlannerAgent(env, config=dict(budget=20, gamma=0.9, step_strategy="subtree",
+                                                       plan_cache_size=10, plan_cache_subtrees=True))
+    action = agent.act(observation)
+    agent.reset()
+    assert agent.act(observation) == action
+    assert agent.plan_cache.hits == 1
+    assert agent.planner.root.state is None
+    for child in agent.planner.root.children.values():
+        assert child.state.viewer is None
@@ -0,0 +1,40 @@
+import multiprocessing
+import threading
+from multiprocessing.connection import Client
+
+import gym
+import pytest
+
+from rl_agents.agents.tree_search.mcts import MCTSAgent
+from rl_agents.agents.tree_search.server import PlanningServer, PlanningClient
+
+CONFIG = {"__class__": "<class 'rl_agents.agents.tree_search.mcts.MCTSAgent'>", "budget": 50, "max_depth": 5}
+
+
+def test_planning_server():
+    env = gym.make('CartPole-v0').unwrapped
+    env.seed(0)
+    observation = env.reset()
+    agent = MCTSAgent(env, config=dict(CONFIG))
+    agent.seed(0)
+    expected = agent.plan(observation)
+
+    server = PlanningServer(workers=2, batch_size=4).start()
+    results = []
+
+    def request():
+        client = PlanningClient(server.address, server.authkey)
+        results.extend(client.plan(CONFIG, env, observation, seed=0) for _ in range(3))
+        client.close()
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Clients must authenticate before sending pickled requests
+    with pytest.raises(multiprocessing.AuthenticationError):
+        Client(server.address, authkey=b"guess")
+    server.close()
+
+    assert results == [expected] * 9
+    assert server.stats["requests"] == 9
@@ -0,0 +1,96 @@
+import gym
+import numpy as np
+from gym import spaces
+
+from rl_agents.agents.tree_search.deterministic import OptimisticDeterministicPlanner
+from rl_agents.agents.tree_search.mcts import MCTS, MCTSAgent
+
+
+class GridEnv(gym.Env):
+    """
+        A deterministic grid in which many action sequences reach the same cells, rewarded near a goal cell.
+    """
+    MOVES = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+
+    def __init__(self, size=6):
+        self.size = size
+        self.action_space = spaces.Discrete(len(self.MOVES))
+        self.observation_space = spaces.Box(0, size - 1, shape=(2,), dtype=int)
+        self.position = np.zeros(2, dtype=int)
+
+    def reset(self):
+        self.position = np.zeros(2, dtype=int)
+        return self.position.copy()
+
+    def step(self, action):
+        self.position = np.clip(self.position + self.MOVES[action], 0, self.size - 1)
+        reward = 1 / (1 + np.abs(self.position - self.size + 1).sum())
+        return self.position.copy(), reward, False, {}
+
+
+def count_shared_nodes(root):
+    parents = {}
+    nodes = [root]
+    for node in nodes:
+        for child in node.children.values():
+            if id(child) not in parents:
+                nodes.append(child)
+            parents.setdefault(id(child), set()).add(id(node))
+    return sum(len(node_parents) > 1 for node_parents in parents.values())
+
+
+def test_mcts_transpositions():
+    env = GridEnv()
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=1000, max_depth=5, transpositions=True, step_strategy="subtree"))
+    planner.seed(0)
+    actions = planner.plan(env, None)
+    assert actions[0] in [0, 1]
+    assert planner.transpositions.hits > 0
+    assert count_shared_nodes(planner.root) > 0
+
+    nodes = [planner.root]
+    for node in nodes:
+        if node.children:
+            assert node.child_counts.sum() <= node.count
+            nodes.extend(node.children.values())
+
+    # The table is re-indexed from the new root
+    planner.step(actions[0])
+    assert min(depth for depth, _ in planner.transpositions.nodes) == 1
+
+
+def test_mcts_transpositions_prior_conversion():
+    env = GridEnv()
+    env.reset()
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy,
+                   dict(budget=1000, max_depth=5, transpositions=True))
+    planner.seed(0)
+    planner.plan(env, None)
+    assert count_shared_nodes(planner.root) > 0
+    # Shared children are reached by different actions from each of their parents, and possibly by several actions
+    # from the same parent, e.g. by the moves towards the walls of a corner
+    nodes = [planner.root]
+    for node in nodes:
+        if node.children:
+            node.convert_visits_to_prior()
+            edge_priors = {}
+            for action, prior in zip(node.child_actions, node.child_priors):
+                edge_priors.setdefault(id(node.children[action]), []).append(prior)
+            assert all(child.prior in edge_priors[id(child)] for child in node.children.values())
+            nodes.extend(child for child in node.children.values() if child.parent is node)
+
+
+def test_deterministic_dominance_pruning():
+    env = GridEnv()
+    env.reset()
+    planners = [OptimisticDeterministicPlanner(dict(budget=400, gamma=0.7, transpositions=transpositions))
+                for transpositions in [False, True]]
+    for planner in planners:
+        planner.plan(env, None)
+    assert planners[1].transpositions.hits > 0
+    assert planners[1].pruned
+    assert all(leaf not in planners[1].leaves for leaf in planners[1].pruned)
+    # The search is not wasted on duplicate states, so the plan is at least as good
+    assert planners[1].root.value >= planners[0].root.value
@@ -0,0 +1,44 @@
+import numpy as np
+
+from rl_agents.agents.tree_search.abstract import Node
+from rl_agents.agents.tree_search.mcts import MCTS, MCTSAgent
+from rl_agents.agents.tree_search.traversal import breadth_first, depth_first
+
+
+def full_tree(branching=3, depth=3):
+    planner = MCTS(MCTSAgent.random_policy, MCTSAgent.random_policy)
+    actions = (np.arange(branching), np.ones(branching) / branching)
+    leaves = [planner.root]
+    for _ in range(depth):
+        next_leaves = []
+        for leaf in leaves:
+            leaf.expand(actions)
+            next_leaves.extend(leaf.children.values())
+        leaves = next_leaves
+    return planner.root
+
+
+def test_traversal_orders():
+    root = full_tree()
+    paths = [list(path) for _, path in Node.breadth_first_search(root)]
+    assert [list(path) for _, path in breadth_first(root, paths=True)] == [[]] + paths
+    assert sorted(paths) == [list(path) for _, path in depth_first(root, paths=True)][1:]
+    for traversal in [breadth_first, depth_first]:
+        for node, depth in traversal(root):
+            assert depth == len(list(node.path()))
+
+
+def test_traversal_limits():
+    root = full_tree()
+    for traversal in [breadth_first, depth_first]:
+        assert max(depth for _, depth in traversal(root, max_depth=2)) == 2
+        assert len(list(traversal(root, max_depth=2))) == 1 + 3 + 9
+        pruned = list(traversal(root, prune=lambda node: node.action == 0))
+        assert len(pruned) == 1 + 3 + 6 + 12
+
+    # A child shared by two parents
+    shared = root.children[0].children[0]
+    dict.__setitem__(root.children[1].children, 0, shared)
+    for traversal in [breadth_first, depth_first]:
+        nodes = [node for node, _ in traversal(root, unique=True)]
+        assert len(nodes) == len(set(map(id, nodes))) == 1 + 3 + 9 + 27 - 4
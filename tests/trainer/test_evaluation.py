@@ -1,6 +1,9 @@
+import json
+
 import gym
 
 from rl_agents.agents.abstract import AbstractAgent
+from rl_agents.agents.tree_search.mcts import MCTSAgent
 from rl_agents.trainer.evaluation import Evaluation
 
 
@@ -44,3 +47,45 @@ class RandomAgent(AbstractAgent):
 
     def load(self, filename):
         pass
+
+
+def test_planner_stats(tmpdir):
+    env = gym.make('CartPole-v0')
+    agent = MCTSAgent(env, config=dict(budget=50, max_depth=5, instrumentation=True))
+    evaluation = Evaluation(env,
+                            agent,
+                            directory=tmpdir.strpath,
+                            num_episodes=2,
+                            display_env=False,
+                            display_agent=False,
+                            display_rewards=False)
+    evaluation.train()
+    stats_files = [file for file in tmpdir.listdir() if 'planner_stats' in file.basename]
+    assert stats_files
+    stats = [json.loads(line) for line in stats_files[0].readlines()]
+    assert len(stats) == sum(evaluation.monitor.stats_recorder.episode_lengths)
+    episodes = [entry["episode"] for entry in stats]
+    assert [episodes.count(episode) for episode in sorted(set(episodes))] == \
+        evaluation.monitor.stats_recorder.episode_lengths
+    assert stats[0]["iterations"] == agent.planner.config["iterations"]
+    assert stats[0]["env_steps"] > 0
+    # The tree is reset when planning the next decisions
+    assert stats[1]["tree_size"] == stats[1]["nodes_created"]
+    assert "copy_time" in stats[0] and "select_time" in stats[0] and "backup_time" in stats[0]
+
+
+def test_close_agent(tmpdir):
+    env = gym.make('CartPole-v0')
+    agent = MCTSAgent(env, config=dict(budget=20, max_depth=5, root_workers=2))
+    evaluation = Evaluation(env,
+                            agent,
+                            directory=tmpdir.strpath,
+                            num_episodes=1,
+                            display_env=False,
+                            display_agent=False,
+                            display_rewards=False)
+    evaluation.train()
+    assert not agent.planner.processes
+    # The planner is not instrumented
+    assert not agent.planner.plan_hooks
+    assert not [file for file in tmpdir.listdir() if 'planner_stats' in file.basename]